@@ -0,0 +1,275 @@
+# bench_data.py - sinh dữ liệu giả lập df1_standard / df2_extended / additional_info_log ở nhiều quy mô
+# (100k → 10M row df1) rồi load qua đúng đường code của db.py: prepare_chunk → load_chunks (COPY) → index
+# → materialized view → facet rollup → data_version. Dữ liệu sinh theo chunk nên RAM không tăng theo số row.
+#
+# Chạy: python bench_data.py [số_row_df1] [seed]
+#   Database đích: BENCH_DATABASE_URL (mặc định postgresql://postgres@localhost:5432/bidfinder_bench)
+#   ⚠️ db.py DROP toàn bộ bảng của database đích → chỉ trỏ vào database benchmark riêng, không dùng DATABASE_URL.
+import os
+import sys
+from datetime import date
+
+import numpy as np
+import pandas as pd
+
+BENCH_DATABASE_URL = os.getenv("BENCH_DATABASE_URL", "postgresql://postgres@localhost:5432/bidfinder_bench")
+BENCH_CHUNK_ROWS = int(os.getenv("BENCH_CHUNK_ROWS", "100000"))
+
+ITEMS_PER_TBMT = 20      # số dòng thuốc trung bình / gói thầu
+DF2_RATIO = 0.5          # df2_extended = DF2_RATIO × df1_standard
+
+# ========== TỪ ĐIỂN ==========
+PROVINCES = [
+    "Hà Nội", "TP. Hồ Chí Minh", "Hải Phòng", "Đà Nẵng", "Cần Thơ", "An Giang", "Bà Rịa - Vũng Tàu",
+    "Bắc Giang", "Bắc Kạn", "Bạc Liêu", "Bắc Ninh", "Bến Tre", "Bình Định", "Bình Dương", "Bình Phước",
+    "Bình Thuận", "Cà Mau", "Cao Bằng", "Đắk Lắk", "Đắk Nông", "Điện Biên", "Đồng Nai", "Đồng Tháp",
+    "Gia Lai", "Hà Giang", "Hà Nam", "Hà Tĩnh", "Hải Dương", "Hậu Giang", "Hòa Bình", "Hưng Yên",
+    "Khánh Hòa", "Kiên Giang", "Kon Tum", "Lai Châu", "Lâm Đồng", "Lạng Sơn", "Lào Cai", "Long An",
+    "Nam Định", "Nghệ An", "Ninh Bình", "Ninh Thuận", "Phú Thọ", "Phú Yên", "Quảng Bình", "Quảng Nam",
+    "Quảng Ngãi", "Quảng Ninh", "Quảng Trị", "Sóc Trăng", "Sơn La", "Tây Ninh", "Thái Bình",
+    "Thái Nguyên", "Thanh Hóa", "Thừa Thiên Huế", "Tiền Giang", "Trà Vinh", "Tuyên Quang", "Vĩnh Long",
+    "Vĩnh Phúc", "Yên Bái",
+]
+
+INVESTOR_TEMPLATES = [
+    "Bệnh viện Đa khoa tỉnh {p}", "Sở Y tế {p}", "Bệnh viện Sản - Nhi {p}", "Bệnh viện Y học cổ truyền {p}",
+    "Trung tâm Kiểm soát bệnh tật {p}", "Bệnh viện Phổi {p}", "Bệnh viện Mắt {p}",
+    "Trung tâm Y tế thành phố {p}", "Bệnh viện Phục hồi chức năng {p}", "Bệnh viện Tâm thần {p}",
+]
+
+SELECTION_METHODS = ["Đấu thầu rộng rãi", "Chào hàng cạnh tranh", "Chỉ định thầu", "Mua sắm trực tiếp",
+                     "Đàm phán giá", "Tự thực hiện"]
+SELECTION_WEIGHTS = [0.55, 0.2, 0.12, 0.06, 0.04, 0.03]
+
+# (hoạt chất, [hàm lượng], dạng bào chế, đường dùng, đơn vị tính, nhóm, giá tham khảo VND)
+DRUGS = [
+    ("Paracetamol", ["500mg", "650mg", "150mg/5ml"], "Viên nén", "Uống", "Viên", "N4", 500),
+    ("Amoxicilin", ["250mg", "500mg", "1g"], "Viên nang", "Uống", "Viên", "N2", 1200),
+    ("Cefuroxim", ["250mg", "500mg"], "Viên nén bao phim", "Uống", "Viên", "N2", 4500),
+    ("Ceftriaxon", ["1g", "2g"], "Bột pha tiêm", "Tiêm", "Lọ", "N1", 18000),
+    ("Omeprazol", ["20mg", "40mg"], "Viên nang tan trong ruột", "Uống", "Viên", "N3", 900),
+    ("Metformin", ["500mg", "850mg", "1000mg"], "Viên nén", "Uống", "Viên", "N4", 700),
+    ("Amlodipin", ["5mg", "10mg"], "Viên nén", "Uống", "Viên", "N4", 400),
+    ("Losartan", ["25mg", "50mg", "100mg"], "Viên nén bao phim", "Uống", "Viên", "N3", 1500),
+    ("Atorvastatin", ["10mg", "20mg", "40mg"], "Viên nén bao phim", "Uống", "Viên", "N3", 2500),
+    ("Vitamin C", ["500mg", "1000mg"], "Viên nén sủi bọt", "Uống", "Viên", "N4", 1800),
+    ("Glucose", ["5%", "10%", "30%"], "Dung dịch tiêm truyền", "Tiêm truyền", "Chai", "N4", 11000),
+    ("Natri clorid", ["0,9%", "3%"], "Dung dịch tiêm truyền", "Tiêm truyền", "Chai", "N4", 9000),
+    ("Ringer lactat", ["500ml"], "Dung dịch tiêm truyền", "Tiêm truyền", "Chai", "N4", 12000),
+    ("Diclofenac", ["50mg", "75mg/3ml"], "Viên nén bao tan trong ruột", "Uống", "Viên", "N4", 350),
+    ("Ibuprofen", ["200mg", "400mg"], "Viên nén bao phim", "Uống", "Viên", "N4", 600),
+    ("Salbutamol", ["2mg", "100mcg/liều"], "Khí dung", "Hít", "Bình", "N3", 65000),
+    ("Insulin người", ["100UI/ml"], "Hỗn dịch tiêm", "Tiêm dưới da", "Lọ", "N1", 120000),
+    ("Cefotaxim", ["1g", "2g"], "Bột pha tiêm", "Tiêm", "Lọ", "N2", 15000),
+    ("Ciprofloxacin", ["500mg", "200mg/100ml"], "Viên nén bao phim", "Uống", "Viên", "N2", 1100),
+    ("Azithromycin", ["250mg", "500mg"], "Viên nén bao phim", "Uống", "Viên", "N2", 5500),
+    ("Methylprednisolon", ["4mg", "16mg", "40mg"], "Viên nén", "Uống", "Viên", "N3", 1300),
+    ("Dexamethason", ["0,5mg", "4mg/ml"], "Dung dịch tiêm", "Tiêm", "Ống", "N4", 2000),
+    ("Furosemid", ["40mg", "20mg/2ml"], "Viên nén", "Uống", "Viên", "N4", 300),
+    ("Enalapril", ["5mg", "10mg"], "Viên nén", "Uống", "Viên", "N4", 450),
+    ("Clopidogrel", ["75mg"], "Viên nén bao phim", "Uống", "Viên", "N3", 3000),
+    ("Gliclazid", ["30mg", "80mg"], "Viên nén giải phóng có kiểm soát", "Uống", "Viên", "N3", 1600),
+    ("Esomeprazol", ["20mg", "40mg"], "Viên nén bao tan trong ruột", "Uống", "Viên", "N3", 3500),
+    ("Loratadin", ["10mg"], "Viên nén", "Uống", "Viên", "N4", 300),
+    ("Acetylcystein", ["200mg"], "Thuốc bột uống", "Uống", "Gói", "N4", 1000),
+    ("Lidocain", ["2%"], "Dung dịch tiêm", "Tiêm", "Ống", "N4", 1500),
+]
+
+# (cơ sở sản xuất, xuất xứ, tiền tố số đăng ký)
+MANUFACTURERS = [
+    ("Công ty CP Dược Hậu Giang", "Việt Nam", "VD"), ("Công ty CP Traphaco", "Việt Nam", "VD"),
+    ("Công ty TNHH Stada Việt Nam", "Việt Nam", "VD"), ("Công ty CP Pymepharco", "Việt Nam", "VD"),
+    ("Công ty CP Dược phẩm Imexpharm", "Việt Nam", "VD"), ("Công ty CP Xuất nhập khẩu Y tế Domesco", "Việt Nam", "VD"),
+    ("Công ty CP Hóa-Dược phẩm Mekophar", "Việt Nam", "VD"), ("Công ty CP Dược phẩm Hà Tây", "Việt Nam", "VD"),
+    ("Công ty CP Dược phẩm OPV", "Việt Nam", "VD"), ("Công ty CP Dược phẩm Trung ương 1 - Pharbaco", "Việt Nam", "VD"),
+    ("Công ty CP Fresenius Kabi Việt Nam", "Việt Nam", "VD"), ("Công ty CP Dược phẩm Agimexpharm", "Việt Nam", "VD"),
+    ("Sanofi Winthrop Industrie", "Pháp", "VN"), ("Pfizer Manufacturing Deutschland GmbH", "Đức", "VN"),
+    ("Les Laboratoires Servier Industrie", "Pháp", "VN"), ("AstraZeneca AB", "Thụy Điển", "VN"),
+    ("Novartis Pharma Stein AG", "Thụy Sĩ", "VN"), ("Novo Nordisk A/S", "Đan Mạch", "QLSP"),
+    ("Cadila Healthcare Ltd.", "Ấn Độ", "VN"), ("Micro Labs Limited", "Ấn Độ", "VN"),
+    ("Medochemie Ltd.", "Cyprus", "VN"), ("Hanmi Pharm. Co., Ltd.", "Hàn Quốc", "VN"),
+    ("Zhejiang Huahai Pharmaceutical Co., Ltd.", "Trung Quốc", "VN"), ("Krka, d.d., Novo mesto", "Slovenia", "VN"),
+    ("B. Braun Melsungen AG", "Đức", "VN"),
+]
+
+# (tên hàng hóa, đơn vị tính, giá tham khảo VND)
+SUPPLIES = [
+    ("Bơm tiêm nhựa dùng một lần 5ml", "Cái", 900), ("Bơm tiêm nhựa dùng một lần 10ml", "Cái", 1200),
+    ("Găng tay phẫu thuật tiệt trùng", "Đôi", 3500), ("Găng tay khám không bột", "Đôi", 1100),
+    ("Kim luồn tĩnh mạch 22G", "Cái", 9000), ("Dây truyền dịch", "Bộ", 4500),
+    ("Bông y tế thấm nước", "Kg", 180000), ("Băng gạc vô trùng 10cm x 10cm", "Miếng", 1500),
+    ("Khẩu trang y tế 4 lớp", "Cái", 600), ("Catheter tĩnh mạch trung tâm 2 nòng", "Bộ", 650000),
+    ("Chỉ phẫu thuật tự tiêu Polyglactin", "Sợi", 55000), ("Ống nghiệm EDTA", "Ống", 1300),
+    ("Que thử đường huyết", "Que", 6000), ("Test nhanh kháng nguyên SARS-CoV-2", "Test", 45000),
+    ("Hóa chất xét nghiệm Glucose", "Hộp", 1500000), ("Phim X-quang kỹ thuật số 35x43cm", "Tấm", 40000),
+    ("Stent động mạch vành phủ thuốc", "Cái", 32000000), ("Thủy tinh thể nhân tạo đơn tiêu", "Cái", 3500000),
+]
+
+SUPPLY_MAKERS = [
+    ("Vinahankook", "Việt Nam"), ("Công ty CP Nhựa Y tế Mediplast", "Việt Nam"), ("Công ty CP Merufa", "Việt Nam"),
+    ("B. Braun", "Malaysia"), ("Terumo", "Nhật Bản"), ("Becton Dickinson", "Singapore"),
+    ("Roche Diagnostics", "Đức"), ("Abbott", "Mỹ"), ("Medtronic", "Mỹ"), ("Shandong Weigao", "Trung Quốc"),
+    ("Top Glove", "Malaysia"), ("Ethicon", "Mỹ"), ("Fujifilm", "Nhật Bản"), ("SD Biosensor", "Hàn Quốc"),
+]
+
+CONTRACTORS = [
+    f"Công ty {kind} {name}"
+    for kind in ("CP Dược phẩm", "TNHH Thương mại Dược phẩm", "CP Thiết bị Y tế", "TNHH Dược phẩm")
+    for name in ("Vimedimex", "Codupha", "Sapharco", "Phú Thái", "Hoàng Đức", "Bạch Mai", "Thành An",
+                 "Trung ương 2", "Minh Dân", "Việt Đức", "Đông Á", "Hòa Bình")
+]
+
+APPROVAL_START = date(2021, 1, 1)
+APPROVAL_DAYS = (date(2025, 12, 31) - APPROVAL_START).days
+
+
+def _catalog(rng) -> pd.DataFrame:
+    """Danh mục thuốc (hoạt chất × hàm lượng × vài cơ sở sản xuất) → df1 chọn theo phân phối lệch (Zipf)"""
+    products = []
+    for drug, strengths, form, route, unit, group, price in DRUGS:
+        for strength in strengths:
+            for m in rng.choice(len(MANUFACTURERS), size=8, replace=False):
+                maker, country, reg = MANUFACTURERS[m]
+                products.append({
+                    "Tên thuốc": f"{drug} {strength}",
+                    "Tên hoạt chất": drug,
+                    "Nồng độ, hàm lượng": strength,
+                    "Đường dùng": route,
+                    "Dạng bào chế": form,
+                    "Quy cách": rng.choice(["Hộp 10 vỉ x 10 viên", "Hộp 3 vỉ x 10 viên", "Chai 500ml",
+                                            "Hộp 10 ống", "Hộp 1 lọ", "Hộp 20 gói"]),
+                    "Nhóm thuốc": group,
+                    "GĐKLH hoặc GPNK": f"{reg}-{rng.integers(10000, 99999)}-{rng.integers(15, 25)}",
+                    "Cơ sở sản xuất": maker,
+                    "Xuất xứ": country,
+                    "Đơn vị tính": unit,
+                    "price": price * (1.0 if country == "Việt Nam" else 2.5) * rng.uniform(0.7, 1.3),
+                })
+    return pd.DataFrame(products)
+
+
+def _zipf_choice(rng, n_items: int, size: int, a: float = 1.2):
+    """Chỉ số 0..n_items-1, giá trị nhỏ phổ biến hơn (vài sản phẩm/gói thầu chiếm phần lớn row)"""
+    return (rng.zipf(a, size) - 1) % n_items
+
+
+def _tbmt_codes(ids) -> np.ndarray:
+    return ("IB" + pd.Series(np.asarray(ids) + 2_400_000_000, dtype="int64").astype(str)).to_numpy(dtype=object)
+
+
+def make_df1_chunk(rng, catalog: pd.DataFrame, n_tbmt: int, size: int) -> pd.DataFrame:
+    picked = catalog.take(_zipf_choice(rng, len(catalog), size)).reset_index(drop=True)
+    quantity = np.maximum(rng.lognormal(7, 1.5, size).round(), 1)
+    price = (picked.pop("price").to_numpy() * rng.uniform(0.85, 1.15, size)).round()
+    df = pd.DataFrame({"Mã TBMT": _tbmt_codes(rng.integers(0, n_tbmt, size))})
+    df = pd.concat([df, picked], axis=1)
+    df["Số lượng"] = quantity
+    df["Đơn giá trúng thầu (VND)"] = price
+    df["Thành tiền (VND)"] = quantity * price
+    df.loc[rng.random(size) < 0.02, "Đơn giá trúng thầu (VND)"] = np.nan
+    df["Nhà thầu trúng thầu"] = np.array(CONTRACTORS, dtype=object)[rng.integers(0, len(CONTRACTORS), size)]
+    df["Hạn dùng (tuổi thọ)"] = rng.choice(["24 tháng", "36 tháng", "48 tháng"], size)
+    return df
+
+
+def make_df2_chunk(rng, n_tbmt: int, size: int) -> pd.DataFrame:
+    items = _zipf_choice(rng, len(SUPPLIES), size, a=1.5)
+    makers = rng.integers(0, len(SUPPLY_MAKERS), size)
+    name = np.array([s[0] for s in SUPPLIES], dtype=object)[items]
+    maker = np.array([m[0] for m in SUPPLY_MAKERS], dtype=object)[makers]
+    country = np.array([m[1] for m in SUPPLY_MAKERS], dtype=object)[makers]
+    brand = maker
+    model = "KM-" + pd.Series(rng.integers(100, 999, size)).astype(str).to_numpy(dtype=object)
+    quantity = np.maximum(rng.lognormal(6, 1.5, size).round(), 1)
+    price = (np.array([s[2] for s in SUPPLIES], dtype=float)[items] * rng.uniform(0.8, 1.25, size)).round()
+    df = pd.DataFrame({
+        "Mã TBMT": _tbmt_codes(rng.integers(0, n_tbmt, size)),
+        "Tên hàng hóa": name,
+        "Nhãn hiệu": brand,
+        "Ký mã hiệu": model,
+        "Tính năng kỹ thuật": rng.choice(["Đạt tiêu chuẩn ISO 13485", "Tiệt trùng bằng khí EO",
+                                          "Đạt tiêu chuẩn CE", "Đạt tiêu chuẩn FDA"], size),
+        "Xuất xứ": country,
+        "Hãng sản xuất": maker,
+        "Đơn vị tính": np.array([s[1] for s in SUPPLIES], dtype=object)[items],
+        "Khối lượng": quantity,
+        "Đơn giá trúng thầu (VND)": price,
+        "Thành tiền (VND)": quantity * price,
+        "Nhà thầu trúng thầu": np.array(CONTRACTORS, dtype=object)[rng.integers(0, len(CONTRACTORS), size)],
+    })
+    df["search"] = df["Tên hàng hóa"] + " | " + df["Nhãn hiệu"] + " | " + df["Ký mã hiệu"] + " | " + df["Xuất xứ"]
+    return df
+
+
+def make_info_chunk(rng, start_id: int, size: int) -> pd.DataFrame:
+    """1 row / gói thầu: chủ đầu tư + địa điểm cùng tỉnh, ngày phê duyệt 2021-2025 (~3% trống)"""
+    province = _zipf_choice(rng, len(PROVINCES), size, a=1.1)
+    template = rng.integers(0, len(INVESTOR_TEMPLATES), size)
+    place = np.array(PROVINCES, dtype=object)[province]
+    investor = [INVESTOR_TEMPLATES[t].format(p=p) for t, p in zip(template, place)]
+    approved = pd.to_datetime(APPROVAL_START) + pd.to_timedelta(rng.integers(0, APPROVAL_DAYS, size), unit="D")
+    expires = approved + pd.to_timedelta(365, unit="D")
+    approved = approved.where(rng.random(size) >= 0.03)
+    ids = np.arange(start_id, start_id + size)
+    return pd.DataFrame({
+        "Mã TBMT": _tbmt_codes(ids),
+        "Chủ đầu tư": investor,
+        "Quyết định phê duyệt": [f"{i % 9000 + 1}/QĐ-BV" for i in ids],
+        "Ngày phê duyệt": approved,
+        "Ngày hết hiệu lực": expires,
+        "Địa điểm": place,
+        "Hình thức LCNT": rng.choice(SELECTION_METHODS, size, p=SELECTION_WEIGHTS),
+        "Tình trạng hiệu lực": np.where(expires >= pd.Timestamp(date.today()), "Còn hiệu lực", "Hết hiệu lực"),
+    })
+
+
+def synthetic_sources(rows: int, seed: int = 0, chunk_rows: int = BENCH_CHUNK_ROWS) -> list:
+    """
+    [(bảng, source)] cùng dạng ingest.table_sources: source() sinh lại đúng dữ liệu (seed theo chunk)
+    → dùng được cho db.main và cả update incremental (đọc 2 lượt).
+    """
+    from ingest import prepare_chunk
+
+    n_tbmt = max(rows // ITEMS_PER_TBMT, 1)
+    catalog = _catalog(np.random.default_rng(seed))
+
+    def chunked(table, total, make):
+        table_no = ["df1_standard", "df2_extended", "additional_info_log"].index(table)
+
+        def source():
+            for i, start in enumerate(range(0, total, chunk_rows)):
+                rng = np.random.default_rng([seed, table_no, i])
+                yield prepare_chunk(make(rng, start, min(chunk_rows, total - start)), table)
+        return source
+
+    return [
+        ("df1_standard", chunked("df1_standard", rows,
+                                 lambda rng, start, size: make_df1_chunk(rng, catalog, n_tbmt, size))),
+        ("df2_extended", chunked("df2_extended", int(rows * DF2_RATIO),
+                                 lambda rng, start, size: make_df2_chunk(rng, n_tbmt, size))),
+        ("additional_info_log", chunked("additional_info_log", n_tbmt,
+                                        lambda rng, start, size: make_info_chunk(rng, start, size))),
+    ]
+
+
+def main():
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    seed = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+
+    # db.py đọc DATABASE_URL (load_dotenv không ghi đè biến đã set) → luôn trỏ vào database benchmark
+    os.environ["DATABASE_URL"] = BENCH_DATABASE_URL
+    import db
+
+    report = db.main(tables=synthetic_sources(rows, seed))
+    if not report or not report.get("success"):
+        sys.exit(1)
+
+    print(f"\n{'stage':<16} {'table':<22} {'seconds':>9} {'rows':>12} {'rows/s':>12} {'peak MB':>9}")
+    for s in report["stages"]:
+        print(f"{s['stage']:<16} {s['table'] or '':<22} {s['seconds']:>9.2f} {s['rows'] or '':>12} "
+              f"{s['rowsPerSec'] or '':>12} {s['peakRssMb'] or '':>9}")
+    print(f"total {report['durationSeconds']:.1f}s, peak RSS {report['peakRssMb']} MB")
+
+
+if __name__ == "__main__":
+    main()
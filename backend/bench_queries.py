@@ -0,0 +1,173 @@
+# bench_queries.py - replay 1 tập QueryRequest đại diện vào server.py, báo p50/p95/p99 + throughput theo loại request
+# Dữ liệu: load trước bằng bench_data.py (filter lấy giá trị từ cùng từ điển nên luôn có kết quả).
+#
+# Chạy: python bench_queries.py [số_request] [concurrency] [url]
+#   - không có url: chạy server.app trong process (httpx.ASGITransport) trên BENCH_DATABASE_URL,
+#     cache response tắt (BENCH_QUERY_CACHE=1 để bật) → đo đúng thời gian query
+#   - có url (vd http://localhost:8001): gửi HTTP tới server đang chạy (cache theo cấu hình server đó)
+# Cần httpx (pip install httpx), không nằm trong requirements.txt của server.
+import asyncio
+import contextlib
+import json
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+from bench_data import BENCH_DATABASE_URL, DRUGS, MANUFACTURERS, PROVINCES, SELECTION_METHODS, SUPPLIES
+
+BENCH_SEED = int(os.getenv("BENCH_SEED", "0"))
+WARMUP_REQUESTS = int(os.getenv("BENCH_WARMUP", "20"))
+
+# Body giống frontend (script.js): limit 200, countMode capped, shape dict
+BASE_BODY = {"limit": 200, "countMode": "capped", "shape": "dict"}
+
+
+def _drug(rng):
+    return rng.choice(DRUGS)[0]
+
+
+def _month_range(rng):
+    year, month = rng.randint(2021, 2025), rng.randint(1, 10)
+    return f"{year}-{month:02d}-01", f"{year}-{month + 2:02d}-28"
+
+
+# (tên, trọng số, hàm sinh (path, body) từ random.Random)
+SCENARIOS = [
+    ("default", 10, lambda rng: ("/api/query", {})),
+    ("drug", 20, lambda rng: ("/api/query", {"filters": {"drugName": _drug(rng).lower()}})),
+    ("drug_no_accent", 8, lambda rng: ("/api/query", {"filters": {"activeIngredient": "natri clorid"}})),
+    ("drug_or", 6, lambda rng: ("/api/query", {"filters": {"activeIngredient": f"{_drug(rng)} OR {_drug(rng)}"}})),
+    ("drug_exclude", 4, lambda rng: ("/api/query", {"filters": {"drugName": f"{_drug(rng)} -tiêm"}})),
+    ("drug_place", 12, lambda rng: ("/api/query", {"filters": {
+        "drugName": _drug(rng), "place": rng.sample(PROVINCES[:10], 2)}})),
+    ("investor_date", 10, lambda rng: ("/api/query", {"filters": dict(zip(
+        ("dateFrom", "dateTo"), _month_range(rng)), investor="bệnh viện đa khoa")})),
+    ("method_validity", 6, lambda rng: ("/api/query", {"filters": {
+        "selectionMethod": rng.sample(SELECTION_METHODS, 2), "validity": "Còn hiệu lực"}})),
+    ("manufacturer_country", 6, lambda rng: ("/api/query", {"filters": {
+        "manufacturer": rng.choice(MANUFACTURERS)[0].split()[-1], "country": rng.choice(MANUFACTURERS)[1]}})),
+    ("sort_price", 6, lambda rng: ("/api/query", {
+        "filters": {"drugName": _drug(rng)}, "sort": [{"column": "unitPrice", "order": rng.choice(["asc", "desc"])}]})),
+    ("df2_supply", 6, lambda rng: ("/api/query", {
+        "filters": {"drugName": rng.choice(SUPPLIES)[0].split()[0]}, "tables": ["df2"]})),
+    ("count_exact", 3, lambda rng: ("/api/query", {"filters": {"drugName": _drug(rng)}, "countMode": "exact"})),
+    ("aggregate", 3, lambda rng: ("/api/aggregate", {
+        "filters": {"activeIngredient": _drug(rng)}, "groupBy": ["place"], "limit": 20})),
+    ("facets", 3, lambda rng: ("/api/facets", {"filters": {"place": [rng.choice(PROVINCES[:10])]}})),
+]
+
+
+def build_requests(n: int, seed: int = BENCH_SEED) -> list:
+    """n request (tên, path, body) theo trọng số SCENARIOS, cùng seed → cùng chuỗi request"""
+    rng = random.Random(seed)
+    names = [s[0] for s in SCENARIOS]
+    weights = [s[1] for s in SCENARIOS]
+    makers = {s[0]: s[2] for s in SCENARIOS}
+    requests = []
+    for name in rng.choices(names, weights, k=n):
+        path, body = makers[name](rng)
+        if path == "/api/query":
+            body = {**BASE_BODY, **body}
+        requests.append((name, path, body))
+    return requests
+
+
+async def replay(client, requests: list, concurrency: int) -> list:
+    """Gửi requests với tối đa concurrency request cùng lúc. Returns: [(tên, giây, status)]"""
+    queue = list(reversed(requests))
+    results = []
+
+    async def worker():
+        while queue:
+            name, path, body = queue.pop()
+            start = time.perf_counter()
+            try:
+                status = (await client.post(path, json=body)).status_code
+            except Exception:
+                status = 0
+            results.append((name, time.perf_counter() - start, status))
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return results
+
+
+def summarize(results: list, wall_seconds: float) -> dict:
+    by_name = {}
+    for name, secs, status in results:
+        by_name.setdefault(name, []).append((secs, status))
+    by_name["ALL"] = [(secs, status) for _, secs, status in results]
+
+    summary = {}
+    for name, items in by_name.items():
+        ms = np.array([s for s, _ in items]) * 1000
+        summary[name] = {
+            "count": len(items),
+            "errors": sum(1 for _, status in items if status != 200),
+            "p50Ms": round(float(np.percentile(ms, 50)), 1),
+            "p95Ms": round(float(np.percentile(ms, 95)), 1),
+            "p99Ms": round(float(np.percentile(ms, 99)), 1),
+            "maxMs": round(float(ms.max()), 1),
+        }
+    summary["ALL"]["throughputRps"] = round(len(results) / wall_seconds, 1)
+    return summary
+
+
+def print_summary(summary: dict):
+    print(f"\n{'scenario':<22} {'count':>6} {'err':>4} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for name, s in sorted(summary.items(), key=lambda kv: (kv[0] == "ALL", kv[0])):
+        print(f"{name:<22} {s['count']:>6} {s['errors']:>4} {s['p50Ms']:>9} {s['p95Ms']:>9} "
+              f"{s['p99Ms']:>9} {s['maxMs']:>9}")
+    print(f"throughput: {summary['ALL']['throughputRps']} req/s")
+
+
+async def run(n: int, concurrency: int, url: str = None) -> dict:
+    import httpx
+
+    requests = build_requests(n)
+    warmup = build_requests(WARMUP_REQUESTS, BENCH_SEED + 1)
+
+    if url:
+        async with httpx.AsyncClient(base_url=url, timeout=120) as client:
+            await replay(client, warmup, concurrency)
+            start = time.perf_counter()
+            results = await replay(client, requests, concurrency)
+            return summarize(results, time.perf_counter() - start)
+
+    # In-process: server đọc DATABASE_URL lúc import → set trước
+    os.environ["DATABASE_URL"] = BENCH_DATABASE_URL
+    if os.getenv("BENCH_QUERY_CACHE", "0") != "1":
+        os.environ["QUERY_CACHE_SIZE"] = "0"
+    os.environ.setdefault("QUERY_TIMING_LOG", "0")
+    import server
+
+    async with server.lifespan(server.app):
+        transport = httpx.ASGITransport(app=server.app)
+        # server print SQL từng request → tắt trong lúc replay (BENCH_VERBOSE=1 để giữ)
+        quiet = os.getenv("BENCH_VERBOSE", "0") != "1"
+        with open(os.devnull, "w") as devnull, \
+                (contextlib.redirect_stdout(devnull) if quiet else contextlib.nullcontext()):
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+                await replay(client, warmup, concurrency)
+                start = time.perf_counter()
+                results = await replay(client, requests, concurrency)
+                summary = summarize(results, time.perf_counter() - start)
+        summary["ALL"]["pool"] = server.pool_stats()
+    return summary
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    concurrency = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    url = sys.argv[3] if len(sys.argv) > 3 else None
+
+    summary = asyncio.run(run(n, concurrency, url))
+    print_summary(summary)
+    # JSON 1 dòng → so sánh giữa các lần chạy
+    print("📈 BENCH " + json.dumps({"requests": n, "concurrency": concurrency, "summary": summary}))
+
+
+if __name__ == "__main__":
+    main()
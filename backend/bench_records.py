@@ -0,0 +1,66 @@
+# bench_records.py - so sánh tốc độ clean_df + df_to_records: iterrows (cũ) vs vectorized (loader.py)
+# Chạy: python bench_records.py [số_rows]
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from loader import clean_df, df_to_records
+
+
+def legacy_clean_df(df: pd.DataFrame) -> pd.DataFrame:
+    df = df.copy()
+    df = df.replace([np.nan, np.inf, -np.inf], None)
+    for col in df.columns:
+        if pd.api.types.is_datetime64_any_dtype(df[col]):
+            df[col] = pd.to_datetime(df[col], errors="coerce")
+    return df
+
+
+def legacy_df_to_records(df: pd.DataFrame):
+    records = []
+    cols = df.columns.tolist()
+    for _, row in df.iterrows():
+        records.append(tuple(row[c] for c in cols))
+    return records, cols
+
+
+def make_df1(n: int) -> pd.DataFrame:
+    """DataFrame giả lập columns_19_20.xlsx (text + numeric, có NaN/inf)"""
+    rng = np.random.default_rng(0)
+    names = np.array(["Paracetamol 500mg", "Amoxicilin 250mg", "Vitamin C", "Cefuroxim", None], dtype=object)
+    units = np.array(["Viên", "Ống", "Chai", "Lọ"], dtype=object)
+    price = rng.uniform(100, 500_000, n)
+    price[rng.random(n) < 0.02] = np.nan
+    price[rng.random(n) < 0.001] = np.inf
+    return pd.DataFrame({
+        "Mã TBMT": [f"IB24{i:08d}" for i in range(n)],
+        "Tên thuốc": names[rng.integers(0, len(names), n)],
+        "Tên hoạt chất": names[rng.integers(0, len(names), n)],
+        "Đơn vị tính": units[rng.integers(0, len(units), n)],
+        "Số lượng": rng.integers(1, 100_000, n),
+        "Đơn giá trúng thầu (VND)": price,
+        "Thành tiền (VND)": price * 10,
+        "Ngày": pd.to_datetime("2024-01-01") + pd.to_timedelta(rng.integers(0, 365, n), unit="D"),
+    })
+
+
+def bench(label, clean, convert, df):
+    t0 = time.perf_counter()
+    records, _ = convert(clean(df))
+    elapsed = time.perf_counter() - t0
+    print(f"{label:<12} {len(records):>9,} rows  {elapsed:7.2f}s  {len(records) / elapsed:>12,.0f} rows/s")
+    return elapsed
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+    df = make_df1(n)
+    old = bench("iterrows", legacy_clean_df, legacy_df_to_records, df)
+    new = bench("vectorized", clean_df, df_to_records, df)
+    print(f"speedup: {old / new:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
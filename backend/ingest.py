@@ -0,0 +1,200 @@
+# ingest.py - đọc processed/*.xlsx qua cache dạng cột (Parquet), parse song song khi cache cũ,
+# hoặc stream theo chunk (INGEST_MODE=stream) để RAM không tăng theo kích thước file
+# openpyxl parse xlsx là bước chậm + tốn RAM nhất của db.py/update_db.py → mỗi file chỉ parse 1 lần
+# cho mỗi phiên bản (mtime + size), các lần chạy sau đọc cache.
+import os
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+
+from schema import NORM_COLUMNS
+from loader import clean_df, add_norm_columns
+
+# df1, df2, add_info - thứ tự file trả về của read_excel_cached
+PROCESSED_FILES = [
+    "processed/columns_19_20.xlsx",
+    "processed/columns_13_14.xlsx",
+    "processed/additional_info_log.xlsx",
+]
+DATA_TABLE_FILES = list(zip(["df1_standard", "df2_extended", "additional_info_log"], PROCESSED_FILES))
+
+# "frame": đọc cả file thành DataFrame (mặc định, dùng cache) | "stream": đọc + load theo chunk
+INGEST_MODE = os.getenv("INGEST_MODE", "frame").lower()
+CHUNK_ROWS = int(os.getenv("INGEST_CHUNK_ROWS", "50000"))
+
+# Thư mục cache (mặc định processed/.cache), EXCEL_CACHE=0 để luôn đọc thẳng xlsx
+CACHE_DIR = os.getenv("EXCEL_CACHE_DIR", "processed/.cache")
+CACHE_ENABLED = os.getenv("EXCEL_CACHE", "1") != "0"
+
+# Số process parse xlsx song song (mặc định = số file cần parse)
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "0")) or None
+
+
+def cache_stem(xlsx: Path) -> str:
+    """Key cache = tên file + mtime + size: file đổi → key đổi → parse lại"""
+    st = xlsx.stat()
+    return f"{xlsx.stem}.{st.st_mtime_ns}-{st.st_size}"
+
+
+def find_cache(xlsx: Path, cache_dir: Path):
+    """File cache còn hợp lệ (.parquet hoặc .pkl) của xlsx, None nếu chưa có/đã cũ"""
+    stem = cache_stem(xlsx)
+    for ext in (".parquet", ".pkl"):
+        path = cache_dir / f"{stem}{ext}"
+        if path.exists():
+            return path
+    return None
+
+
+def write_cache(df: pd.DataFrame, xlsx: Path, cache_dir: Path) -> Path:
+    """
+    Ghi Parquet (cần pyarrow); cột object lẫn kiểu (vd. số + text) hoặc thiếu pyarrow → fallback pickle.
+    Ghi file tạm rồi os.replace → không để lại cache dở dang nếu bị kill giữa chừng.
+    Xóa cache phiên bản cũ của cùng file.
+    """
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    stem = cache_stem(xlsx)
+    for old in cache_dir.glob(f"{xlsx.stem}.*"):
+        old.unlink(missing_ok=True)
+
+    try:
+        path = cache_dir / f"{stem}.parquet"
+        tmp = path.with_suffix(".parquet.tmp")
+        df.to_parquet(tmp, index=False)
+    except Exception:
+        path = cache_dir / f"{stem}.pkl"
+        tmp = path.with_suffix(".pkl.tmp")
+        df.to_pickle(tmp)
+    os.replace(tmp, path)
+    return path
+
+
+def read_cache(path: Path) -> pd.DataFrame:
+    if path.suffix == ".parquet":
+        return pd.read_parquet(path)
+    return pd.read_pickle(path)
+
+
+def _parse_to_cache(xlsx: str, cache_dir: str) -> str:
+    """Chạy trong worker process: parse xlsx → ghi cache, trả path (không gửi DataFrame qua pipe)"""
+    df = pd.read_excel(xlsx)
+    return str(write_cache(df, Path(xlsx), Path(cache_dir)))
+
+
+def read_excel_cached(paths, cache_dir: str = CACHE_DIR, log=print) -> list:
+    """
+    Đọc list file xlsx → list DataFrame (cùng thứ tự).
+    File có cache hợp lệ → đọc cache; file cũ/chưa có cache → parse song song bằng ProcessPoolExecutor.
+    """
+    paths = [Path(p) for p in paths]
+    if not CACHE_ENABLED:
+        return [pd.read_excel(p) for p in paths]
+
+    cache_dir = Path(cache_dir)
+    cached = {p: find_cache(p, cache_dir) for p in paths}
+    stale = [p for p, c in cached.items() if c is None]
+
+    if stale:
+        log(f"🧮 Parsing {len(stale)} xlsx → cache", ", ".join(p.name for p in stale))
+        workers = min(INGEST_WORKERS or len(stale), len(stale))
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                results = pool.map(_parse_to_cache, [str(p) for p in stale], [str(cache_dir)] * len(stale))
+                for p, c in zip(stale, results):
+                    cached[p] = Path(c)
+        else:
+            for p in stale:
+                cached[p] = Path(_parse_to_cache(str(p), str(cache_dir)))
+
+    hits = len(paths) - len(stale)
+    if hits:
+        log("⚡ Excel cache hit", f"{hits}/{len(paths)} files")
+    return [read_cache(cached[p]) for p in paths]
+
+
+# ========== STREAMING (INGEST_MODE=stream) ==========
+def iter_excel_chunks(path, chunk_rows: int = CHUNK_ROWS):
+    """openpyxl read-only: sheet đầu tiên → DataFrame từng chunk_rows row (header = row 1)"""
+    from openpyxl import load_workbook
+
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = wb.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        columns = [str(h) if h is not None else f"Unnamed: {i}" for i, h in enumerate(header)]
+        width = len(columns)
+
+        buf = []
+        for row in rows:
+            # read-only mode có thể trả row dài/ngắn hơn header hoặc row rỗng ở cuối sheet
+            if all(v is None for v in row):
+                continue
+            row = tuple(row[:width]) + (None,) * (width - len(row))
+            buf.append(row)
+            if len(buf) >= chunk_rows:
+                yield pd.DataFrame(buf, columns=columns)
+                buf = []
+        if buf:
+            yield pd.DataFrame(buf, columns=columns)
+    finally:
+        wb.close()
+
+
+def iter_parquet_chunks(path: Path, chunk_rows: int = CHUNK_ROWS):
+    import pyarrow.parquet as pq
+
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_rows):
+        yield batch.to_pandas()
+
+
+def iter_processed_chunks(path, chunk_rows: int = CHUNK_ROWS, cache_dir: str = CACHE_DIR):
+    """Chunk từ cache Parquet nếu còn hợp lệ, không thì parse xlsx read-only (pickle không stream được)"""
+    path = Path(path)
+    cached = find_cache(path, Path(cache_dir)) if CACHE_ENABLED else None
+    if cached is not None and cached.suffix == ".parquet":
+        return iter_parquet_chunks(cached, chunk_rows)
+    return iter_excel_chunks(path, chunk_rows)
+
+
+def prepare_chunk(df: pd.DataFrame, table: str) -> pd.DataFrame:
+    """clean_df + cột norm_* của bảng"""
+    return add_norm_columns(clean_df(df), NORM_COLUMNS.get(table, {}))
+
+
+def table_source(table: str, mode: str = INGEST_MODE):
+    """
+    source() của 1 bảng, chỉ đọc file khi được gọi → dùng trong worker process
+    (update_db.py LOAD_WORKERS > 1: mỗi process đọc + convert + load 1 bảng)
+    """
+    path = dict(DATA_TABLE_FILES)[table]
+    if mode == "stream":
+        return lambda: (prepare_chunk(c, table) for c in iter_processed_chunks(path))
+    return lambda: [prepare_chunk(read_excel_cached([path])[0], table)]
+
+
+def table_sources(mode: str = INGEST_MODE, log=print, profiler=None) -> list:
+    """
+    [(bảng, source)] cho df1_standard, df2_extended, additional_info_log.
+    source() trả iterable DataFrame đã prepare, gọi lại được nhiều lần (update incremental đọc 2 lượt):
+      - frame: đọc hết 3 file 1 lần (read_excel_cached), source() = [df]
+      - stream: mỗi lần gọi source() đọc lại file theo chunk, RAM ~ 1 chunk
+    profiler (load_profile.LoadProfiler): stage read + clean từng bảng ở mode frame
+    (mode stream: đọc + clean nằm trong phần load.source của load_chunks)
+    """
+    if mode == "stream":
+        log("🌊 Streaming ingestion", f"{CHUNK_ROWS:,} rows/chunk")
+        return [(table, table_source(table, mode)) for table, _ in DATA_TABLE_FILES]
+
+    with profiler.stage("read") if profiler else nullcontext():
+        frames = read_excel_cached(PROCESSED_FILES, log=log)
+    sources = []
+    for (table, _), df in zip(DATA_TABLE_FILES, frames):
+        with profiler.stage("clean", table, len(df)) if profiler else nullcontext():
+            df = prepare_chunk(df, table)
+        log("✅ Loaded", f"{table}={len(df)}")
+        sources.append((table, lambda df=df: [df]))
+    return sources
@@ -0,0 +1,106 @@
+# load_profile.py - đo thời gian, throughput và RAM (RSS) từng bước của db.py / update_db.py
+# Report JSON in ra cuối job + append vào bảng load_profile → so sánh được lần load hôm nay với hôm qua.
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+from schema import create_load_profile_table
+
+try:
+    import resource
+except ImportError:  # Windows: không có peak RSS
+    resource = None
+
+
+def peak_rss_mb():
+    """Peak RSS của process (+ worker parse xlsx đã kết thúc), MB"""
+    if resource is None:
+        return None
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    # Linux: KB, macOS: bytes
+    return round(peak / (1 << 20 if sys.platform == "darwin" else 1 << 10), 1)
+
+
+def current_rss_mb():
+    """RSS hiện tại (Linux /proc), None nếu không đọc được"""
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+        return round(pages * os.sysconf("SC_PAGE_SIZE") / (1 << 20), 1)
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+class LoadProfiler:
+    """
+    Danh sách stage {stage, table, seconds, rows, rowsPerSec, rssMb, peakRssMb} theo thứ tự chạy.
+    with profiler.stage("indexes"): ... hoặc profiler.add("df1_standard.write", secs, rows) cho số đo sẵn.
+    """
+
+    def __init__(self, script: str, mode: str):
+        self.script = script
+        self.mode = mode
+        self.started_at = datetime.now()
+        self._start = time.perf_counter()
+        self.stages = []
+        self.success = None
+
+    @contextmanager
+    def stage(self, name: str, table: str = None, rows: int = None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start, rows, table)
+
+    def add(self, name: str, seconds: float, rows: int = None, table: str = None):
+        entry = {"stage": name, "table": table, "seconds": round(seconds, 3), "rows": rows,
+                 "rowsPerSec": round(rows / seconds) if rows and seconds > 0 else None,
+                 "rssMb": current_rss_mb(), "peakRssMb": peak_rss_mb()}
+        self.stages.append(entry)
+        return entry
+
+    def add_load(self, table: str, rows: int, seconds: float, stats: dict):
+        """Kết quả load_chunks: tổng + từng phần (source/hash/convert/write) của 1 bảng"""
+        self.add("load", seconds, rows, table)
+        for part in ("source", "hash", "convert", "write"):
+            if part in stats:
+                self.add(f"load.{part}", stats[part], rows, table)
+
+    def report(self) -> dict:
+        return {
+            "script": self.script,
+            "mode": self.mode,
+            "startedAt": self.started_at.isoformat(timespec="seconds"),
+            "durationSeconds": round(time.perf_counter() - self._start, 3),
+            "peakRssMb": peak_rss_mb(),
+            "success": self.success,
+            "stages": self.stages,
+        }
+
+    def save(self, conn, log=print):
+        """In report JSON + INSERT vào load_profile (transaction riêng, lỗi không làm fail job)"""
+        report = self.report()
+        log("📈 LOAD PROFILE", json.dumps(report, ensure_ascii=False))
+        if conn is None:
+            return report
+        try:
+            with conn.cursor() as cur:
+                create_load_profile_table(cur)
+                cur.execute(
+                    """
+                    INSERT INTO load_profile (script, mode, started_at, duration_seconds, peak_rss_mb, success, report)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s)
+                    """,
+                    (self.script, self.mode, self.started_at, report["durationSeconds"],
+                     report["peakRssMb"], self.success, json.dumps(report, ensure_ascii=False)),
+                )
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            log("⚠️ Load profile not saved", str(e))
+        return report
@@ -0,0 +1,314 @@
+# loader.py - DataFrame → records dùng chung cho db.py (init) và update_db.py (daily update)
+import itertools
+import time
+
+import numpy as np
+import pandas as pd
+
+from text_norm import fold_text
+
+_INF_VALUES = [np.inf, -np.inf]
+
+
+def clean_df(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    NaN/inf/NaT → None, xử lý theo từng cột (vectorized, không df.replace toàn bảng).
+    Mọi cột trả về dtype object chứa Python scalar (int/float/str/Timestamp/None)
+    → psycopg2 adapt trực tiếp, không gặp numpy.int64.
+    """
+    cleaned = {}
+    for col in df.columns:
+        s = df[col]
+        if pd.api.types.is_datetime64_any_dtype(s):
+            mask = s.isna().to_numpy()
+        else:
+            mask = (s.isna() | s.isin(_INF_VALUES)).to_numpy()
+
+        values = s.to_numpy(dtype=object)
+        if mask.any():
+            values[mask] = None
+        # dtype=object tường minh: pandas không được infer lại None → NaN
+        cleaned[col] = pd.Series(values, index=df.index, dtype=object)
+
+    return pd.DataFrame(cleaned, index=df.index, columns=df.columns)
+
+
+def iter_records(df: pd.DataFrame):
+    """DataFrame (đã clean_df) → iterator tuple theo row (lazy, không dựng list cả bảng)"""
+    return zip(*(df[c].to_numpy(dtype=object) for c in df.columns))
+
+
+def df_to_records(df: pd.DataFrame):
+    """DataFrame (đã clean_df) → (list tuple theo row, list cột), zip theo cột thay vì iterrows"""
+    return list(iter_records(df)), df.columns.tolist()
+
+
+def add_norm_columns(df: pd.DataFrame, norm_map: dict) -> pd.DataFrame:
+    """Thêm các cột shadow norm_* (đã fold) vào DataFrame theo map {cột gốc: cột norm}"""
+    for src, norm in norm_map.items():
+        if src in df.columns:
+            # Giữ dtype object: Series.map có thể infer sang str dtype và biến None → NaN
+            folded = [fold_text(v) for v in df[src].to_numpy(dtype=object)]
+            df[norm] = pd.Series(folded, index=df.index, dtype=object)
+    return df
+
+
+# ========== COPY FROM STDIN ==========
+def _copy_text(val) -> str:
+    """1 giá trị → field của COPY text format (NULL = \\N, escape \\ tab newline)"""
+    if val is None:
+        return "\\N"
+    if isinstance(val, bool):
+        return "t" if val else "f"
+    s = val if isinstance(val, str) else str(val)
+    if "\\" in s or "\t" in s or "\n" in s or "\r" in s:
+        s = s.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+    return s
+
+
+class CopyStream:
+    """
+    File-like read() sinh dữ liệu COPY text từ iterable records ngay khi được đọc (không temp file).
+    fill_seconds: thời gian sinh dữ liệu (kể cả kéo records từ generator) → phần còn lại của COPY là network/server.
+    """
+
+    def __init__(self, records, batch_rows: int = 1000):
+        self._rows = iter(records)
+        self._batch_rows = batch_rows
+        self._buf = b""
+        self.rows = 0
+        self.fill_seconds = 0.0
+
+    def _fill(self) -> bool:
+        start = time.perf_counter()
+        try:
+            return self._fill_batch()
+        finally:
+            self.fill_seconds += time.perf_counter() - start
+
+    def _fill_batch(self) -> bool:
+        lines = []
+        for row in self._rows:
+            lines.append("\t".join(_copy_text(v) for v in row))
+            if len(lines) >= self._batch_rows:
+                break
+        if not lines:
+            return False
+        self.rows += len(lines)
+        self._buf += ("\n".join(lines) + "\n").encode("utf-8")
+        return True
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            while self._fill():
+                pass
+        else:
+            while len(self._buf) < size and self._fill():
+                pass
+            if len(self._buf) > size:
+                chunk, self._buf = self._buf[:size], self._buf[size:]
+                return chunk
+        chunk, self._buf = self._buf, b""
+        return chunk
+
+
+def copy_records(cur, table_name, columns, records, buffer_size: int = 1 << 20, stats: dict = None) -> int:
+    """COPY records vào table_name qua STDIN (1 round-trip cho cả bảng). Returns: số row"""
+    cols_str = ", ".join(f'"{c}"' for c in columns)
+    stream = CopyStream(records)
+    start = time.perf_counter()
+    cur.copy_expert(f'COPY "{table_name}" ({cols_str}) FROM STDIN', stream, size=buffer_size)
+    if stats is not None:
+        stats["fill"] = stats.get("fill", 0.0) + stream.fill_seconds
+        stats["copy"] = stats.get("copy", 0.0) + time.perf_counter() - start
+    return stream.rows
+
+
+def _timed_chunks(chunks, stats: dict):
+    """Cộng thời gian lấy từng chunk (đọc file + clean ở INGEST_MODE=stream) vào stats["source"]"""
+    chunks = iter(chunks)
+    while True:
+        start = time.perf_counter()
+        chunk = next(chunks, None)
+        stats["source"] += time.perf_counter() - start
+        if chunk is None:
+            return
+        yield chunk
+
+
+def load_chunks(cur, table_name, chunks, mode: str = "copy", insert_fn=None, on_chunk=None,
+                stats: dict = None):
+    """
+    Load iterable DataFrame (đã clean + norm) vào table_name, giữ tối đa 1 chunk trong RAM.
+    mode="copy": 1 lệnh COPY FROM STDIN cho mọi chunk; mode khác: insert_fn(cur, table, cols, records) từng chunk.
+    on_chunk(df): callback cho từng chunk (vd. TbmtHasher.update).
+    stats: dict → được điền số giây source (lấy chunk) / hash (on_chunk) / convert (→ records/COPY text) / write (DB)
+    Returns: (số row, số giây)
+    """
+    start = time.perf_counter()
+    timing = {"source": 0.0, "hash": 0.0, "convert": 0.0, "write": 0.0}
+    chunks = _timed_chunks(chunks, timing)
+    first = next(chunks, None)
+    if first is None:
+        if stats is not None:
+            stats.update(timing)
+        return 0, time.perf_counter() - start
+
+    def hash_chunk(chunk):
+        if on_chunk:
+            t0 = time.perf_counter()
+            on_chunk(chunk)
+            timing["hash"] += time.perf_counter() - t0
+
+    rows = 0
+    if mode == "copy" or insert_fn is None:
+        def records():
+            for chunk in itertools.chain([first], chunks):
+                hash_chunk(chunk)
+                yield from iter_records(chunk)
+
+        copy_stats = {}
+        first_source = timing["source"]
+        rows = copy_records(cur, table_name, first.columns.tolist(), records(), stats=copy_stats)
+        # fill = source (trừ chunk đầu) + hash + convert (generator chạy bên trong CopyStream.read)
+        timing["convert"] = max(copy_stats["fill"] - (timing["source"] - first_source) - timing["hash"], 0.0)
+        timing["write"] = copy_stats["copy"] - copy_stats["fill"]
+    else:
+        for chunk in itertools.chain([first], chunks):
+            hash_chunk(chunk)
+            t0 = time.perf_counter()
+            records, columns = df_to_records(chunk)
+            t1 = time.perf_counter()
+            insert_fn(cur, table_name, columns, records)
+            timing["convert"] += t1 - t0
+            timing["write"] += time.perf_counter() - t1
+            rows += len(records)
+    if stats is not None:
+        stats.update(timing)
+    return rows, time.perf_counter() - start
+
+
+def load_table(cur, table_name, df: pd.DataFrame, mode: str = "copy", insert_fn=None):
+    """Convert + load 1 DataFrame vào table_name. Returns: (số row, số giây)"""
+    return load_chunks(cur, table_name, [df], mode, insert_fn)
+
+
+# ========== INCREMENTAL (delta theo "Mã TBMT") ==========
+KEY_COLUMN = "Mã TBMT"
+_HASH_MASK = (1 << 64) - 1
+
+
+def _hash_text(val) -> str:
+    """Chuỗi chuẩn để hash: 5.0 và 5 (xlsx đọc cả file vs theo chunk infer dtype khác nhau) → '5'"""
+    if val is None:
+        return "\\N"
+    if isinstance(val, float) and val.is_integer():
+        return str(int(val))
+    return str(val)
+
+
+class TbmtHasher:
+    """
+    Hash nội dung theo từng gói thầu, cộng dồn được theo chunk.
+    Hash gói = tổng hash từng row (modulo 2^64) + số row → không phụ thuộc thứ tự row/cách chia chunk.
+    Key NULL được gom vào '' (tbmt_hash.tbmt NOT NULL).
+    """
+
+    def __init__(self, key: str = KEY_COLUMN):
+        self.key = key
+        self.sums = {}
+        self.counts = {}
+
+    def update(self, df: pd.DataFrame):
+        if len(df) == 0:
+            return
+        content_cols = [c for c in df.columns if not c.startswith("norm_")]
+        canon = pd.DataFrame(
+            {c: [_hash_text(v) for v in df[c].to_numpy(dtype=object)] for c in content_cols}
+        )
+        row_hash = pd.util.hash_pandas_object(canon, index=False).to_numpy()
+        keys = df[self.key].fillna("").astype(str).to_numpy()
+        grouped = pd.DataFrame({"k": keys, "h": row_hash}).groupby("k", sort=False)["h"]
+        sums, counts = grouped.sum(), grouped.size()
+        for k, h, n in zip(sums.index, sums.to_numpy(), counts.to_numpy()):
+            self.sums[k] = (self.sums.get(k, 0) + int(h)) & _HASH_MASK
+            self.counts[k] = self.counts.get(k, 0) + int(n)
+
+    def hashes(self) -> pd.Series:
+        """Series {Mã TBMT: 'hash-số_row'}"""
+        return pd.Series(
+            {k: f"{h:016x}-{self.counts[k]}" for k, h in self.sums.items()}, dtype=object
+        )
+
+
+def tbmt_hashes(df: pd.DataFrame, key: str = KEY_COLUMN) -> pd.Series:
+    hasher = TbmtHasher(key)
+    hasher.update(df)
+    return hasher.hashes()
+
+
+def read_hashes(cur, table_name: str) -> dict:
+    cur.execute("SELECT tbmt, hash FROM tbmt_hash WHERE table_name = %s", (table_name,))
+    return dict(cur.fetchall())
+
+
+def write_hashes(cur, table_name: str, hashes: pd.Series):
+    copy_records(cur, "tbmt_hash", ["table_name", "tbmt", "hash"],
+                 ((table_name, k, h) for k, h in hashes.items()))
+
+
+def replace_hashes(cur, table_name: str, hashes: pd.Series):
+    """Ghi lại toàn bộ hash của 1 bảng (sau full load/swap) → lần update incremental sau có mốc so sánh"""
+    cur.execute("DELETE FROM tbmt_hash WHERE table_name = %s", (table_name,))
+    write_hashes(cur, table_name, hashes)
+
+
+def sync_table_delta(cur, table_name: str, source, mode: str = "copy",
+                     insert_fn=None, key: str = KEY_COLUMN) -> dict:
+    """
+    Chỉ ghi các gói thầu thay đổi: so hash mới với tbmt_hash,
+    DELETE row của gói đổi/bị xóa, load lại row của gói đổi/mới.
+    source(): iterable DataFrame chunk, được đọc 2 lượt (hash rồi load) → RAM chỉ giữ hash theo gói.
+    Chưa có hash nào (DB cũ, chưa từng ghi tbmt_hash) → xóa hết bảng, load lại toàn bộ.
+    Returns: thống kê delta
+    """
+    hasher = TbmtHasher(key)
+    for chunk in source():
+        hasher.update(chunk)
+    new_hashes = hasher.hashes()
+    old_hashes = read_hashes(cur, table_name)
+
+    deleted_rows = 0
+    if not old_hashes:
+        cur.execute(f"DELETE FROM {table_name}")
+        deleted_rows = cur.rowcount
+
+    added = [k for k in new_hashes.index if k not in old_hashes]
+    changed = [k for k, h in new_hashes.items() if k in old_hashes and old_hashes[k] != h]
+    removed = [k for k in old_hashes if k not in new_hashes.index]
+
+    stale = changed + removed
+    if stale:
+        stale_keys = [k for k in stale if k != ""]
+        cur.execute(
+            f'DELETE FROM {table_name} WHERE "{key}" = ANY(%s) OR (%s AND "{key}" IS NULL)',
+            (stale_keys, "" in stale),
+        )
+        deleted_rows += cur.rowcount
+        cur.execute(
+            "DELETE FROM tbmt_hash WHERE table_name = %s AND tbmt = ANY(%s)",
+            (table_name, stale),
+        )
+
+    fresh = set(added + changed)
+    inserted_rows = 0
+    if fresh:
+        chunks = (c[c[key].fillna("").astype(str).isin(fresh).to_numpy()] for c in source())
+        inserted_rows, _ = load_chunks(cur, table_name, chunks, mode, insert_fn)
+        write_hashes(cur, table_name, new_hashes[new_hashes.index.isin(fresh)])
+
+    return {
+        "added": len(added), "changed": len(changed), "removed": len(removed),
+        "unchanged": len(new_hashes) - len(added) - len(changed),
+        "deleted_rows": deleted_rows, "inserted_rows": inserted_rows,
+    }
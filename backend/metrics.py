@@ -0,0 +1,112 @@
+# metrics.py - đo thời gian từng bước của request (/api/query, ...) + histogram latency + log query chậm
+# Chỉ dùng trong 1 event loop (không lock), giống query_cache.ResponseCache.
+import bisect
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+# Biên trên bucket (giây); bucket cuối = +Inf
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+class LatencyHistogram:
+    """Đếm theo bucket cố định → percentile xấp xỉ (biên trên của bucket chứa percentile, ≤ max)"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, seconds: float):
+        self.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    def quantile(self, q: float):
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank and n:
+                return min(self.buckets[i], self.max) if i < len(self.buckets) else self.max
+        return self.max
+
+    def snapshot(self) -> dict:
+        ms = lambda s: round(s * 1000, 2) if s is not None else None
+        return {
+            "count": self.count,
+            "avgMs": ms(self.total / self.count) if self.count else None,
+            "p50Ms": ms(self.quantile(0.5)),
+            "p95Ms": ms(self.quantile(0.95)),
+            "p99Ms": ms(self.quantile(0.99)),
+            "maxMs": ms(self.max),
+            "buckets": {
+                (f"le{ms(b)}" if i < len(self.buckets) else "inf"): n
+                for i, (b, n) in enumerate(zip(self.buckets + (None,), self.counts))
+            },
+        }
+
+
+class RequestTimer:
+    """Thời gian từng bước của 1 request: with timer.stage('build'): ... / timer.add('df1.data', secs)"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.stages = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(name, time.perf_counter() - start)
+
+    def add(self, name: str, seconds: float):
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start
+
+    def as_ms(self) -> dict:
+        return {name: round(secs * 1000, 2) for name, secs in self.stages.items()}
+
+
+class Metrics:
+    """Histogram theo tên ('query.total', 'query.df1.data', ...) + N query chậm gần nhất"""
+
+    def __init__(self, slow_log_size: int = 50):
+        self.started_at = time.time()
+        self.histograms = {}
+        self.slow_queries = deque(maxlen=slow_log_size)
+
+    def observe(self, name: str, seconds: float):
+        hist = self.histograms.get(name)
+        if hist is None:
+            hist = self.histograms[name] = LatencyHistogram()
+        hist.observe(seconds)
+
+    def observe_request(self, prefix: str, timer: RequestTimer, total_name: str = "total"):
+        """Ghi tổng thời gian + từng stage của timer vào histogram '{prefix}.{stage}'"""
+        self.observe(f"{prefix}.{total_name}", timer.elapsed)
+        for name, seconds in timer.stages.items():
+            self.observe(f"{prefix}.{name}", seconds)
+
+    def add_slow_query(self, entry: dict) -> dict:
+        entry = {"at": datetime.now().isoformat(timespec="seconds"), **entry}
+        self.slow_queries.append(entry)
+        return entry
+
+    def snapshot(self) -> dict:
+        return {
+            "uptimeSeconds": round(time.time() - self.started_at, 1),
+            "histograms": {name: h.snapshot() for name, h in sorted(self.histograms.items())},
+            "slowQueries": list(reversed(self.slow_queries)),
+        }
@@ -0,0 +1,75 @@
+# query_cache.py - cache response /api/query trong process (LRU + TTL), lưu sẵn bytes JSON
+import time
+from collections import OrderedDict
+
+
+class ResponseCache:
+    """
+    LRU theo số entry + tổng bytes, mỗi entry hết hạn sau ttl giây.
+    Chỉ dùng trong 1 event loop (không lock).
+    """
+
+    def __init__(self, max_entries: int = 512, max_bytes: int = 64 << 20, ttl: float = 300):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._items = OrderedDict()   # key → (expires_at, body)
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def get(self, key: str):
+        item = self._items.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+        expires_at, body = item
+        if expires_at < time.monotonic():
+            self._remove(key)
+            self.misses += 1
+            return None
+        self._items.move_to_end(key)
+        self.hits += 1
+        return body
+
+    def put(self, key: str, body: bytes):
+        if not self.enabled or len(body) > self.max_bytes:
+            return
+        if key in self._items:
+            self._remove(key)
+        self._items[key] = (time.monotonic() + self.ttl, body)
+        self._bytes += len(body)
+        while len(self._items) > self.max_entries or self._bytes > self.max_bytes:
+            self._remove(next(iter(self._items)))
+            self.evictions += 1
+
+    def clear(self):
+        """Xóa toàn bộ (data version đổi sau khi update_db.py load xong)"""
+        self._items.clear()
+        self._bytes = 0
+        self.invalidations += 1
+
+    def _remove(self, key: str):
+        _, body = self._items.pop(key)
+        self._bytes -= len(body)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._items),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hitRate": round(self.hits / lookups, 4) if lookups else None,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "maxEntries": self.max_entries,
+            "maxBytes": self.max_bytes,
+            "ttlSeconds": self.ttl,
+        }
@@ -0,0 +1,463 @@
+# schema.py - DDL dùng chung cho db.py (init) và update_db.py (daily update)
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+# ========== NORMALIZED SEARCH COLUMNS ==========
+# Cột shadow norm_* = fold_text(cột gốc) (bỏ dấu, lowercase, gộp khoảng trắng),
+# được loader tính sẵn 1 lần lúc load → query không phải LOWER() từng row.
+NORM_COLUMNS = {
+    "df1_standard": {
+        "Tên thuốc": "norm_ten_thuoc",
+        "Tên hoạt chất": "norm_hoat_chat",
+        "Nồng độ, hàm lượng": "norm_nong_do",
+        "Đường dùng": "norm_duong_dung",
+        "Dạng bào chế": "norm_dang_bao_che",
+        "Quy cách": "norm_quy_cach",
+        "Nhóm thuốc": "norm_nhom_thuoc",
+        "GĐKLH hoặc GPNK": "norm_so_dang_ky",
+        "Đơn vị tính": "norm_don_vi_tinh",
+        "Cơ sở sản xuất": "norm_co_so_sx",
+        "Xuất xứ": "norm_xuat_xu",
+    },
+    # df2: mọi filter thuốc/hàng hóa search trên cột concat "search"
+    "df2_extended": {
+        "search": "norm_search",
+    },
+    # additional_info_log: filter chung cho cả df1_full/df2_full
+    "additional_info_log": {
+        "Chủ đầu tư": "norm_chu_dau_tu",
+        "Quyết định phê duyệt": "norm_quyet_dinh",
+    },
+}
+
+# ========== TABLES ==========
+# Cột dữ liệu (ngoài id/created_at/norm_*) của từng bảng, đúng tên cột trong file Excel
+TABLE_COLUMNS = {
+    "df1_standard": """
+                "Mã TBMT" TEXT,
+                "Tên thuốc" TEXT,
+                "Tên hoạt chất" TEXT,
+                "Nồng độ, hàm lượng" TEXT,
+                "Đường dùng" TEXT,
+                "Dạng bào chế" TEXT,
+                "Quy cách" TEXT,
+                "Nhóm thuốc" TEXT,
+                "GĐKLH hoặc GPNK" TEXT,
+                "Cơ sở sản xuất" TEXT,
+                "Xuất xứ" TEXT,
+                "Đơn vị tính" TEXT,
+                "Số lượng" NUMERIC,
+                "Đơn giá trúng thầu (VND)" NUMERIC,
+                "Thành tiền (VND)" NUMERIC,
+                "Nhà thầu trúng thầu" TEXT,
+                "Hạn dùng (tuổi thọ)" TEXT,""",
+    "df2_extended": """
+                "Mã TBMT" TEXT,
+                "Tên hàng hóa" TEXT,
+                "Nhãn hiệu" TEXT,
+                "Ký mã hiệu" TEXT,
+                "Tính năng kỹ thuật" TEXT,
+                "Xuất xứ" TEXT,
+                "Hãng sản xuất" TEXT,
+                "Đơn vị tính" TEXT,
+                "Khối lượng" NUMERIC,
+                "Đơn giá trúng thầu (VND)" NUMERIC,
+                "Thành tiền (VND)" NUMERIC,
+                "Nhà thầu trúng thầu" TEXT,
+                "search" TEXT,""",
+    "additional_info_log": """
+                "Mã TBMT" TEXT,
+                "Chủ đầu tư" TEXT,
+                "Quyết định phê duyệt" TEXT,
+                "Ngày phê duyệt" DATE,
+                "Ngày hết hiệu lực" DATE,
+                "Địa điểm" TEXT,
+                "Hình thức LCNT" TEXT,
+                "Tình trạng hiệu lực" TEXT,""",
+    "run_history": """
+                start_time TIMESTAMP,
+                end_time TIMESTAMP,
+                duration_seconds INTEGER,
+                boxes_selected INTEGER,""",
+}
+
+# Các bảng dữ liệu load từ processed/*.xlsx (run_history load từ JSON)
+DATA_TABLES = ["df1_standard", "df2_extended", "additional_info_log"]
+
+
+def create_table(cur, table: str, name: str = None):
+    """CREATE TABLE theo TABLE_COLUMNS[table] (+ id, created_at, norm_*), name khác table cho bảng staging"""
+    norm_cols = "".join(f"\n                {norm} TEXT," for norm in NORM_COLUMNS.get(table, {}).values())
+    cur.execute(f"""
+        CREATE TABLE {name or table} (
+                id SERIAL PRIMARY KEY,{TABLE_COLUMNS[table]}{norm_cols}
+                created_at TIMESTAMP DEFAULT NOW()
+        );
+        """)
+
+
+# ========== TBMT HASH (update incremental) ==========
+# Hash nội dung theo (bảng, Mã TBMT) của lần load gần nhất → update_db chỉ ghi gói thầu thay đổi
+def create_hash_table(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS tbmt_hash (
+                table_name TEXT NOT NULL,
+                tbmt TEXT NOT NULL,
+                hash TEXT NOT NULL,
+                PRIMARY KEY (table_name, tbmt)
+        );
+        """)
+
+
+# ========== LOAD PROFILE ==========
+# 1 row / lần chạy db.py hoặc update_db.py (report JSON của load_profile.LoadProfiler), không drop khi init lại
+def create_load_profile_table(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS load_profile (
+                id SERIAL PRIMARY KEY,
+                script TEXT NOT NULL,
+                mode TEXT,
+                started_at TIMESTAMP,
+                duration_seconds REAL,
+                peak_rss_mb REAL,
+                success BOOLEAN,
+                report JSONB,
+                created_at TIMESTAMP DEFAULT NOW()
+        );
+        """)
+
+
+# ========== DATA VERSION ==========
+# 1 row, tăng mỗi lần loader commit dữ liệu mới → server.py biết khi nào xóa cache /api/query
+def create_data_version_table(cur):
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS data_version (
+                id INTEGER PRIMARY KEY DEFAULT 1 CHECK (id = 1),
+                version BIGINT NOT NULL,
+                updated_at TIMESTAMP DEFAULT NOW()
+        );
+        """)
+
+
+def bump_data_version(cur):
+    """Gọi trong transaction commit dữ liệu → version mới hiện ra cùng lúc với data mới"""
+    cur.execute("""
+        INSERT INTO data_version (id, version, updated_at) VALUES (1, 1, NOW())
+        ON CONFLICT (id) DO UPDATE SET version = data_version.version + 1, updated_at = NOW()
+        """)
+
+
+# ========== MATERIALIZED df1_full / df2_full ==========
+# server.py đọc df1_full/df2_full. Trước đây là VIEW → mỗi query chạy lại LEFT JOIN additional_info_log
+# và filter cột ai.* không dùng chung index với cột d1.*. Giờ là MATERIALIZED VIEW (join sẵn lúc load)
+# → index composite theo sort mặc định cho query top-N đi thẳng trên index.
+FULL_VIEWS = {
+    "df1_full": ("df1_standard", "df1"),   # view: (bảng gốc, prefix tên index)
+    "df2_full": ("df2_extended", "df2"),
+}
+
+AI_VIEW_COLUMNS = """
+                ai."Chủ đầu tư",
+                ai."Quyết định phê duyệt",
+                ai."Ngày phê duyệt",
+                ai."Ngày hết hiệu lực",
+                ai."Địa điểm",
+                ai."Hình thức LCNT",
+                ai."Tình trạng hiệu lực",
+                ai.norm_chu_dau_tu,
+                ai.norm_quyet_dinh,
+                COALESCE(ai.id, 0) AS ai_id"""
+
+
+# ========== INDEXES ==========
+# (tên index, relation, biểu thức cột, loại: btree | gin | unique)
+
+# Bảng gốc: chỉ cần Mã TBMT (join khi build view + DELETE theo gói thầu của update incremental)
+TABLE_INDEXES = [
+    ("idx_df1_ma_tbmt", "df1_standard", '"Mã TBMT"', "btree"),
+    ("idx_df2_ma_tbmt", "df2_extended", '"Mã TBMT"', "btree"),
+    ("idx_ai_ma_tbmt", "additional_info_log", '"Mã TBMT"', "btree"),
+]
+
+# Sort của server.py (ALLOWED_SORT_DF1/DF2 — giữ đồng bộ) trên df1_full/df2_full.
+# ORDER BY luôn kết thúc bằng id (keyset) → index (cột, id): ASC NULLS LAST đọc xuôi khớp hết,
+# DESC NULLS FIRST đọc ngược + Incremental Sort id trong nhóm bằng nhau; điều kiện keyset seek thẳng vào index.
+# "Địa điểm"/"Tình trạng hiệu lực" còn phục vụ filter = ANY / =.
+# Không index riêng "Hình thức LCNT": chỉ dùng làm filter, vài giá trị → planner hầu như không chọn.
+_VIEW_SORT_COLUMNS = {
+    "df1_full": [
+        ("soluong", "Số lượng"),
+        ("tenthuoc", "Tên thuốc"),
+    ],
+    "df2_full": [
+        ("soluong", "Khối lượng"),
+        ("ten_hang_hoa", "Tên hàng hóa"),
+    ],
+}
+_BASE_SORT_COLUMNS = [
+    ("tbmt", "Mã TBMT"),
+    ("donvitinh", "Đơn vị tính"),
+    ("dongia", "Đơn giá trúng thầu (VND)"),
+    ("thanhtien", "Thành tiền (VND)"),
+    ("xuat_xu", "Xuất xứ"),
+    ("nhathau", "Nhà thầu trúng thầu"),
+    ("ai_chu_dau_tu", "Chủ đầu tư"),
+    ("ai_quyet_dinh", "Quyết định phê duyệt"),
+    ("ai_ngay_phe_duyet", "Ngày phê duyệt"),
+    ("ai_ngay_het_hieu_luc", "Ngày hết hiệu lực"),
+    ("ai_dia_diem", "Địa điểm"),
+    ("ai_tinh_trang", "Tình trạng hiệu lực"),
+]
+
+BASE_INDEXES = [
+    (f"idx_{prefix}_{name}", view, f'"{column}", id', "btree")
+    for view, (_, prefix) in FULL_VIEWS.items()
+    for name, column in _BASE_SORT_COLUMNS + _VIEW_SORT_COLUMNS[view]
+] + [
+    # Khớp ORDER BY mặc định của /api/query (+ id tiebreak keyset) → top-N / trang sau đọc theo index,
+    # đồng thời phục vụ filter khoảng "Ngày phê duyệt"
+    (f"idx_{prefix}_default_order", view, '"Ngày phê duyệt" DESC NULLS LAST, "Mã TBMT", id', "btree")
+    for view, (_, prefix) in FULL_VIEWS.items()
+] + [
+    # REFRESH MATERIALIZED VIEW CONCURRENTLY cần unique index (1 row d1 có thể join nhiều row ai)
+    (f"idx_{prefix}_row", view, "id, ai_id", "unique")
+    for view, (_, prefix) in FULL_VIEWS.items()
+]
+
+# server.py search bằng norm_col LIKE '%term%'. Btree không phục vụ được LIKE có
+# wildcard đầu → dùng GIN + pg_trgm trên các cột norm_* (của bảng + của additional_info_log).
+SEARCH_INDEXES = [
+    (f"idx_{prefix}_{norm}", view, f'"{norm}" gin_trgm_ops', "gin")
+    for view, (table, prefix) in FULL_VIEWS.items()
+    for norm in list(NORM_COLUMNS[table].values()) + list(NORM_COLUMNS["additional_info_log"].values())
+]
+
+ALL_INDEXES = TABLE_INDEXES + BASE_INDEXES + SEARCH_INDEXES
+
+
+def index_sql(name: str, relation: str, expr: str, using: str) -> str:
+    unique = "UNIQUE " if using == "unique" else ""
+    method = "gin" if using == "gin" else "btree"
+    return f"CREATE {unique}INDEX IF NOT EXISTS {name} ON {relation} USING {method} ({expr});"
+
+
+def relation_indexes(relation: str) -> list:
+    return [idx for idx in ALL_INDEXES if idx[1] == relation]
+
+
+def select_indexes(relations=None) -> list:
+    return [idx for idx in ALL_INDEXES if relations is None or idx[1] in relations]
+
+
+def create_indexes(cur, relations=None, suffix: str = ""):
+    """
+    Tạo index (idempotent) cho các relation (mặc định: mọi bảng + view),
+    suffix != "" → index/relation bản staging.
+    """
+    cur.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm;")
+    for name, relation, expr, using in select_indexes(relations):
+        cur.execute(index_sql(f"{name}{suffix}", f"{relation}{suffix}", expr, using))
+
+
+# ========== BULK LOAD SESSION ==========
+# Index luôn build 1 lần sau khi load xong (bảng mới / staging chưa có index) → session load nâng
+# maintenance_work_mem (sort CREATE INDEX trong RAM thay vì spill ra đĩa) + worker song song của Postgres
+# cho btree; work_mem cho hash join/sort lúc build materialized view, facet rollup, REFRESH CONCURRENTLY.
+LOAD_MAINTENANCE_WORK_MEM = os.getenv("LOAD_MAINTENANCE_WORK_MEM", "512MB")
+LOAD_PARALLEL_MAINTENANCE_WORKERS = int(os.getenv("LOAD_PARALLEL_MAINTENANCE_WORKERS", "4"))
+LOAD_WORK_MEM = os.getenv("LOAD_WORK_MEM", "128MB")
+
+
+def tune_load_session(cur):
+    """SET cấp session (giữ qua các transaction của connection này)"""
+    cur.execute("SET maintenance_work_mem = %s;", (LOAD_MAINTENANCE_WORK_MEM,))
+    cur.execute("SET max_parallel_maintenance_workers = %s;", (LOAD_PARALLEL_MAINTENANCE_WORKERS,))
+    cur.execute("SET work_mem = %s;", (LOAD_WORK_MEM,))
+
+
+def create_indexes_parallel(connect, relations=None, suffix: str = "", workers: int = 4):
+    """
+    Như create_indexes nhưng trên `workers` connection (connect() → psycopg2 connection) cùng lúc,
+    mỗi connection lấy lần lượt index từ hàng đợi chung. CREATE INDEX chỉ lấy SHARE lock → nhiều index
+    trên cùng bảng build song song được. Relation phải đã commit (connection khác mới thấy). Mỗi index tự commit.
+    """
+    # GIN trigram chậm nhất → lấy trước, btree lấp chỗ trống sau
+    pending = sorted(select_indexes(relations), key=lambda idx: idx[3] != "gin")
+    pending.reverse()
+
+    def worker():
+        conn = connect()
+        try:
+            conn.autocommit = True
+            with conn.cursor() as cur:
+                tune_load_session(cur)
+                while pending:
+                    try:
+                        name, relation, expr, using = pending.pop()
+                    except IndexError:
+                        break
+                    cur.execute(index_sql(f"{name}{suffix}", f"{relation}{suffix}", expr, using))
+        finally:
+            conn.close()
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for future in [pool.submit(worker) for _ in range(min(workers, len(pending)))]:
+            future.result()
+
+
+# ========== VIEWS ==========
+def drop_views(cur, suffix: str = ""):
+    """DROP df1_full/df2_full dù đang là VIEW (bản cũ) hay MATERIALIZED VIEW"""
+    for view in FULL_VIEWS:
+        cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", (f"{view}{suffix}",))
+        row = cur.fetchone()
+        if row:
+            kind = "MATERIALIZED VIEW" if row[0] == "m" else "VIEW"
+            cur.execute(f"DROP {kind} {view}{suffix} CASCADE;")
+
+
+def create_views(cur, suffix: str = "", indexes: bool = True):
+    """
+    DROP + CREATE MATERIALIZED VIEW df1_full/df2_full từ bảng {table}{suffix} + index của view
+    (indexes=False → caller tự build sau, vd song song bằng create_indexes_parallel).
+    Giữ nguyên contract cột cho server.py (d1.* / d2.* + cột ai.*).
+    """
+    drop_views(cur, suffix)
+    for view, (table, _) in FULL_VIEWS.items():
+        cur.execute(f"""
+            CREATE MATERIALIZED VIEW {view}{suffix} AS
+            SELECT
+                d.*,{AI_VIEW_COLUMNS}
+            FROM {table}{suffix} d
+            LEFT JOIN additional_info_log{suffix} ai ON ai."Mã TBMT" = d."Mã TBMT"
+        """)
+    if indexes:
+        create_indexes(cur, list(FULL_VIEWS), suffix)
+
+
+def refresh_views(cur):
+    """
+    Build lại df1_full/df2_full sau update incremental. CONCURRENTLY: reader vẫn đọc bản cũ đến khi commit.
+    DB cũ còn VIEW thường → tạo materialized view lần đầu.
+    """
+    cur.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass('df1_full')")
+    row = cur.fetchone()
+    if not row or row[0] != "m":
+        create_views(cur)
+        return
+    for view in FULL_VIEWS:
+        cur.execute(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {view};")
+
+
+# ========== FACET ROLLUP ==========
+# Đếm sẵn theo (bảng, tháng phê duyệt, facet, giá trị) sau mỗi lần load → /api/facets cộng
+# vài nghìn row rollup thay vì GROUP BY toàn bộ df1_full/df2_full mỗi request.
+# Mỗi facet 1 rollup riêng (không phải cube tích chéo các facet): số row ~ tháng × số giá trị của facet,
+# đủ cho trường hợp phổ biến — facet đang đếm bỏ filter của chính nó, chỉ còn filter khoảng ngày.
+FACET_COLUMNS = {
+    "selectionMethod": "Hình thức LCNT",
+    "place": "Địa điểm",
+    "origin": "Xuất xứ",
+    "validity": "Tình trạng hiệu lực",
+}
+FACET_ROLLUP = "facet_rollup"
+
+
+def build_facet_rollup(cur, suffix: str = ""):
+    """(Re)build facet_rollup{suffix} từ df1_full{suffix}/df2_full{suffix} (DELETE + INSERT, MVCC)"""
+    table = f"{FACET_ROLLUP}{suffix}"
+    # Bản cũ (1 cột / facet, cube tích chéo) → tạo lại theo layout mới
+    cur.execute(
+        "SELECT 1 FROM information_schema.columns WHERE table_name = %s AND column_name = 'facet'", (table,))
+    if not cur.fetchone():
+        cur.execute(f"DROP TABLE IF EXISTS {table};")
+    cur.execute(f"""
+        CREATE TABLE IF NOT EXISTS {table} (
+                table_name TEXT NOT NULL,
+                month DATE,
+                facet TEXT NOT NULL,
+                value TEXT,
+                row_count BIGINT NOT NULL,
+                total_amount NUMERIC
+        );
+        """)
+    cur.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_facet_month ON {table} (table_name, facet, month);")
+    cur.execute(f"DELETE FROM {table};")
+
+    # 1 lần quét mỗi view: mỗi row tách thành 1 (facet, giá trị) cho từng facet rồi GROUP BY
+    facet_values = ", ".join(f"('{facet}', \"{col}\")" for facet, col in FACET_COLUMNS.items())
+    for view, (_, prefix) in FULL_VIEWS.items():
+        cur.execute(f"""
+            INSERT INTO {table} (table_name, month, facet, value, row_count, total_amount)
+            SELECT '{prefix}', date_trunc('month', v."Ngày phê duyệt")::date, f.facet, f.value,
+                   COUNT(*), SUM(v."Thành tiền (VND)")
+            FROM {view}{suffix} v
+            CROSS JOIN LATERAL (VALUES {facet_values}) AS f(facet, value)
+            GROUP BY 2, 3, 4
+        """)
+
+
+# ========== STAGING + ATOMIC SWAP ==========
+# update_db.py load vào bảng {table}__staging (không ai đọc), build index + materialized view,
+# rồi swap trong 1 transaction ngắn → reader /api/query không bị block suốt thời gian load.
+STAGING_SUFFIX = "__staging"
+
+
+def staging_name(name: str) -> str:
+    return f"{name}{STAGING_SUFFIX}"
+
+
+def create_staging_tables(cur, tables=DATA_TABLES):
+    # pg_trgm tạo sẵn ở đây (commit trước khi load) → connection build index song song thấy gin_trgm_ops
+    cur.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm;")
+    drop_staging_tables(cur, tables)
+    for table in tables:
+        create_table(cur, table, staging_name(table))
+
+
+def drop_staging_tables(cur, tables=DATA_TABLES):
+    # CASCADE: kéo theo df1_full__staging/df2_full__staging
+    for table in tables:
+        cur.execute(f"DROP TABLE IF EXISTS {staging_name(table)} CASCADE;")
+    cur.execute(f"DROP TABLE IF EXISTS {staging_name(FACET_ROLLUP)};")
+
+
+def create_staging_views(cur):
+    """Materialized view + facet rollup staging (chưa có index view: build sau bằng create_staging_indexes)"""
+    create_views(cur, STAGING_SUFFIX, indexes=False)
+    build_facet_rollup(cur, STAGING_SUFFIX)
+
+
+def create_staging_indexes(cur, connect=None, workers: int = 1, tables=DATA_TABLES):
+    """
+    Index bảng + view staging (1 lần sau khi load + build view, staging đã commit).
+    workers > 1 → song song trên nhiều connection (connect), ngược lại tuần tự trên cur.
+    """
+    relations = list(tables) + list(FULL_VIEWS)
+    if workers > 1 and connect is not None:
+        create_indexes_parallel(connect, relations, STAGING_SUFFIX, workers)
+    else:
+        create_indexes(cur, relations, STAGING_SUFFIX)
+
+
+def swap_staging_tables(cur, tables=DATA_TABLES):
+    """
+    Thay bảng + materialized view live bằng bản staging (gọi trong 1 transaction, commit = swap atomic).
+    View staging tham chiếu bảng theo OID → sau khi đổi tên vẫn trỏ đúng bảng live mới.
+    """
+    drop_views(cur)
+    for table in tables:
+        staging = staging_name(table)
+        cur.execute(f"DROP TABLE IF EXISTS {table} CASCADE;")
+        cur.execute(f"ALTER TABLE {staging} RENAME TO {table};")
+        cur.execute(f"ALTER INDEX {staging}_pkey RENAME TO {table}_pkey;")
+        cur.execute(f"ALTER SEQUENCE {staging}_id_seq RENAME TO {table}_id_seq;")
+    for view in FULL_VIEWS:
+        cur.execute(f"ALTER MATERIALIZED VIEW {staging_name(view)} RENAME TO {view};")
+    for name, relation, _, _ in ALL_INDEXES:
+        if relation in tables or relation in FULL_VIEWS:
+            cur.execute(f"ALTER INDEX {staging_name(name)} RENAME TO {name};")
+
+    cur.execute(f"DROP TABLE IF EXISTS {FACET_ROLLUP};")
+    cur.execute(f"ALTER TABLE {staging_name(FACET_ROLLUP)} RENAME TO {FACET_ROLLUP};")
+    cur.execute(f"ALTER INDEX idx_{staging_name(FACET_ROLLUP)}_facet_month RENAME TO idx_{FACET_ROLLUP}_facet_month;")
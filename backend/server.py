@@ -1,22 +1,128 @@
 from fastapi import FastAPI, Query
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
 from contextlib import asynccontextmanager
 from pydantic import BaseModel
-from typing import Optional, List
+from typing import Optional, List, Dict
 import asyncpg
 from fastapi import Response
 import json
 from pathlib import Path
 import os
 import re
+import asyncio
+import base64
+import time
+import csv
+import io
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+try:
+    import orjson
+except ImportError:  # chạy được không cần orjson (chậm hơn)
+    orjson = None
+
+from schema import NORM_COLUMNS, FACET_COLUMNS, FACET_ROLLUP
+from text_norm import fold_text
+from query_cache import ResponseCache
+from suggest import build_indexes
+from metrics import Metrics, RequestTimer
 
 
 # ========== DATABASE CONFIG ==========
 DATABASE_URL = os.getenv("DATABASE_URL")
 db_pool: Optional[asyncpg.Pool] = None
 
+# Count mode cho /api/query:
+# - "exact":    COUNT(*) toàn bộ kết quả filter (chậm nhất)
+# - "capped":   COUNT(*) dừng ở COUNT_CAP + 1 row → "10.000+"
+# - "estimate": số row planner ước lượng (EXPLAIN, không chạy query)
+# - "none":     bỏ qua count
+COUNT_MODES = ("exact", "capped", "estimate", "none")
+COUNT_CAP = int(os.getenv("COUNT_CAP", "10000"))
+
+# Page size tối đa/bảng; trang sau lấy bằng cursor thay vì tăng limit
+MAX_QUERY_LIMIT = int(os.getenv("MAX_QUERY_LIMIT", "1000"))
+
+# Số row mỗi lần fetch từ server-side cursor khi export (= 1 chunk gửi client)
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "2000"))
+
+# Số connection tối đa 1 request /api/query được giữ cùng lúc (pool max_size=10)
+QUERY_CONCURRENCY = int(os.getenv("QUERY_CONCURRENCY", "4"))
+
+# Search mode cho text filter:
+# - "trgm": norm_col LIKE '%term_đã_fold%' trên cột shadow norm_* (bỏ dấu, lowercase)
+#           → dùng được GIN pg_trgm indexes (schema.SEARCH_INDEXES)
+# - "like": LOWER(col) LIKE LOWER('%term%') kiểu cũ (seq scan, phân biệt dấu)
+SEARCH_MODE = os.getenv("SEARCH_MODE", "trgm").lower()
+
+# Cache response /api/query (LRU + TTL, trong process). QUERY_CACHE_SIZE=0 để tắt.
+# Xóa khi data_version (update_db.py tăng sau mỗi lần load) đổi; version đọc lại tối đa
+# mỗi DATA_VERSION_CHECK_SECONDS giây thay vì mỗi request.
+QUERY_CACHE_SIZE = int(os.getenv("QUERY_CACHE_SIZE", "512"))
+QUERY_CACHE_MAX_BYTES = int(os.getenv("QUERY_CACHE_MAX_MB", "64")) << 20
+QUERY_CACHE_TTL = float(os.getenv("QUERY_CACHE_TTL", "600"))
+DATA_VERSION_CHECK_SECONDS = float(os.getenv("DATA_VERSION_CHECK_SECONDS", "5"))
+
+query_cache = ResponseCache(QUERY_CACHE_SIZE, QUERY_CACHE_MAX_BYTES, QUERY_CACHE_TTL)
+data_version_state = {"version": None, "checked_at": 0.0}
+
+# Đo thời gian /api/query theo từng bước (build, chờ pool, data/count query, serialize):
+# - QUERY_TIMING_LOG=0 để tắt log 1 dòng JSON / request
+# - request chậm hơn SLOW_QUERY_MS được giữ lại (SLOW_QUERY_LOG_SIZE cái gần nhất) trong /api/metrics
+# - SLOW_QUERY_EXPLAIN=1: chạy thêm EXPLAIN (ANALYZE, BUFFERS) cho query chậm ở background
+#   (chạy lại query → tốn gấp đôi, chỉ bật khi cần tune index; mỗi lúc tối đa 1 EXPLAIN)
+QUERY_TIMING_LOG = os.getenv("QUERY_TIMING_LOG", "1") != "0"
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "1000"))
+SLOW_QUERY_LOG_SIZE = int(os.getenv("SLOW_QUERY_LOG_SIZE", "50"))
+SLOW_QUERY_EXPLAIN = os.getenv("SLOW_QUERY_EXPLAIN", "0") == "1"
+SLOW_QUERY_EXPLAIN_TIMEOUT_MS = int(os.getenv("SLOW_QUERY_EXPLAIN_TIMEOUT_MS", "30000"))
+
+metrics = Metrics(SLOW_QUERY_LOG_SIZE)
+explain_state = {"running": False}
+# Giữ reference task EXPLAIN đang chạy (event loop chỉ giữ weak ref → task có thể bị GC giữa chừng)
+explain_tasks = set()
+
+# Autocomplete /api/suggest: field → cột trong từng view, giá trị distinct load vào RAM
+# lúc startup và mỗi khi data_version đổi
+SUGGEST_COLUMNS = {
+    "place": {"df1_full": "Địa điểm", "df2_full": "Địa điểm"},
+    "selectionMethod": {"df1_full": "Hình thức LCNT", "df2_full": "Hình thức LCNT"},
+    "investor": {"df1_full": "Chủ đầu tư", "df2_full": "Chủ đầu tư"},
+    "manufacturer": {"df1_full": "Cơ sở sản xuất", "df2_full": "Hãng sản xuất"},
+    "country": {"df1_full": "Xuất xứ", "df2_full": "Xuất xứ"},
+}
+MAX_SUGGESTIONS = int(os.getenv("MAX_SUGGESTIONS", "50"))
+
+suggest_state = {"indexes": None, "version": None}
+suggest_lock = asyncio.Lock()
+
+# Nén response (gzip) khi client gửi Accept-Encoding: gzip và body >= GZIP_MIN_SIZE bytes
+GZIP_MIN_SIZE = int(os.getenv("GZIP_MIN_SIZE", "1024"))
+GZIP_LEVEL = int(os.getenv("GZIP_LEVEL", "6"))
+
+# Multi-term search → 1 param text[] / nhóm term thay vì 1 param / term:
+#   must:    col LIKE ANY($n) AND col LIKE ALL($n)   (ANY dùng được GIN trigram, ALL lọc chính xác)
+#   exclude: col NOT LIKE ALL($n)
+#   OR:      col LIKE ANY($n)
+# → SQL chỉ phụ thuộc filter nào có mặt, không phụ thuộc số term → ít shape, prepared statement dùng lại được.
+SEARCH_ARRAY_PARAMS = os.getenv("SEARCH_ARRAY_PARAMS", "0") == "1"
+
+# Prepared statement cache / connection của asyncpg (key = text SQL). Builder sinh SQL ổn định
+# theo tổ hợp filter → cache lớn hơn mặc định (100) để giữ đủ các shape hay dùng.
+# Đặt 0 nếu đi qua pgbouncer transaction mode.
+STATEMENT_CACHE_SIZE = int(os.getenv("STATEMENT_CACHE_SIZE", "512"))
+
+# '"Tên thuốc"' → 'norm_ten_thuoc' (cột trong df1_full/df2_full)
+SEARCH_NORM_COLUMNS = {
+    f'"{src}"': norm
+    for norm_map in NORM_COLUMNS.values()
+    for src, norm in norm_map.items()
+}
+
 # ========== PYDANTIC MODELS ==========
 class FilterRequest(BaseModel):
     investor: Optional[str] = None
@@ -46,6 +152,24 @@ class QueryRequest(BaseModel):
     filters: Optional[FilterRequest] = None
     sort: Optional[List[SortRule]] = None
     limit: Optional[int] = 200
+    countMode: Optional[str] = "exact"  # 'exact' | 'capped' | 'estimate' | 'none'
+    countCap: Optional[int] = None      # ngưỡng cho mode 'capped' (mặc định COUNT_CAP)
+    cursors: Optional[Dict[str, str]] = None  # {'df1': nextCursor, 'df2': ...} từ response trước
+    tables: Optional[List[str]] = None        # chỉ query các bảng này (mặc định cả df1, df2)
+    shape: Optional[str] = "rows"             # 'rows' (list object) | 'columnar' (columns + rows array) | 'dict'
+
+class AggregateRequest(BaseModel):
+    filters: Optional[FilterRequest] = None
+    table: Optional[str] = "df1"              # 'df1' | 'df2'
+    groupBy: Optional[List[str]] = None       # key trong ALLOWED_GROUP_DF1/DF2, vd ['activeIngredient', 'unit']
+    percentiles: Optional[List[float]] = None # percentile đơn giá, mặc định AGG_DEFAULT_PERCENTILES
+    limit: Optional[int] = 100                # số nhóm tối đa (nhiều row nhất trước)
+
+class FacetRequest(BaseModel):
+    filters: Optional[FilterRequest] = None
+    tables: Optional[List[str]] = None        # mặc định cả df1, df2
+    facets: Optional[List[str]] = None        # key trong FACET_COLUMNS, mặc định tất cả
+    limit: Optional[int] = 50                 # số giá trị tối đa mỗi facet (nhiều row nhất trước)
 
 # ========== DATABASE HELPERS ==========
 # ========== DATABASE HELPERS ==========
@@ -59,10 +183,217 @@ async def get_db_pool():
         min_size=1,          # Render free nên để thấp
         max_size=10,
         command_timeout=60,
+        statement_cache_size=STATEMENT_CACHE_SIZE,
         # Nếu Neon yêu cầu SSL mà DSN không đủ thì bật dòng dưới:
         # ssl="require",
     )
 
+async def run_concurrently(jobs, concurrency: int = QUERY_CONCURRENCY, timings: Optional[list] = None):
+    """
+    Chạy song song các (method, sql, params) trên nhiều connection của db_pool.
+    Semaphore giới hạn số connection/request để 1 request không chiếm hết pool.
+    timings: list rỗng → được điền (giây chờ acquire, giây chạy query) theo thứ tự jobs.
+    Returns: kết quả theo đúng thứ tự jobs
+    """
+    sem = asyncio.Semaphore(max(1, concurrency))
+    if timings is not None:
+        timings[:] = [(0.0, 0.0)] * len(jobs)
+
+    async def run(i, method, sql, params):
+        async with sem:
+            start = time.perf_counter()
+            async with db_pool.acquire() as conn:
+                acquired = time.perf_counter()
+                result = await getattr(conn, method)(sql, *params)
+            if timings is not None:
+                timings[i] = (acquired - start, time.perf_counter() - acquired)
+            return result
+
+    return await asyncio.gather(*(run(i, *job) for i, job in enumerate(jobs)))
+
+def pool_stats() -> dict:
+    """Số connection của db_pool: đang mở / rảnh / đang dùng"""
+    if db_pool is None:
+        return {}
+    size, idle = db_pool.get_size(), db_pool.get_idle_size()
+    return {
+        "min": db_pool.get_min_size(), "max": db_pool.get_max_size(),
+        "size": size, "idle": idle, "inUse": size - idle,
+        "utilization": round((size - idle) / db_pool.get_max_size(), 3),
+    }
+
+async def explain_slow_query(entry: dict, queries: list):
+    """
+    EXPLAIN (ANALYZE, BUFFERS) các query của 1 request chậm → entry["explain"] (chạy background).
+    Caller set explain_state["running"] trước create_task; xong (kể cả lỗi) → clear ở đây.
+    """
+    try:
+        async with db_pool.acquire() as conn:
+            for name, sql, params in queries:
+                # count mode 'estimate' đã là EXPLAIN → không EXPLAIN lồng
+                if sql.lstrip().upper().startswith("EXPLAIN"):
+                    continue
+                try:
+                    async with conn.transaction():
+                        await conn.execute(f"SET LOCAL statement_timeout = {SLOW_QUERY_EXPLAIN_TIMEOUT_MS}")
+                        rows = await conn.fetch("EXPLAIN (ANALYZE, BUFFERS) " + sql, *params)
+                    entry["explain"][name] = "\n".join(r[0] for r in rows)
+                except Exception as e:
+                    entry["explain"][name] = f"EXPLAIN failed: {e}"
+    finally:
+        explain_state["running"] = False
+
+def record_query_timing(timer: RequestTimer, request: QueryRequest, tables: list, sql_jobs: list):
+    """Histogram + log JSON 1 dòng; request chậm → slow log (+ EXPLAIN nếu bật)"""
+    metrics.observe_request("query", timer)
+    total_ms = round(timer.elapsed * 1000, 2)
+    if QUERY_TIMING_LOG:
+        print("⏱️ /api/query " + json.dumps({"totalMs": total_ms, "tables": tables, **timer.as_ms()}))
+    if total_ms < SLOW_QUERY_MS:
+        return
+
+    filters = request.filters.model_dump(exclude_none=True) if request.filters else {}
+    entry = metrics.add_slow_query({
+        "totalMs": total_ms,
+        "stages": timer.as_ms(),
+        "filters": {k: v for k, v in filters.items() if v},
+        "sort": [[r.column, r.order] for r in request.sort or []],
+        "tables": tables,
+        "sql": {name: sql for name, sql, _ in sql_jobs},
+        "explain": {},
+    })
+    print(f"🐢 Slow query {total_ms:.0f}ms: {json.dumps(entry['filters'], ensure_ascii=False, default=str)}")
+    if SLOW_QUERY_EXPLAIN and not explain_state["running"]:
+        # Set trước create_task: nhiều request chậm cùng lúc → chỉ 1 EXPLAIN ANALYZE chạy trên pool
+        explain_state["running"] = True
+        task = asyncio.create_task(explain_slow_query(entry, sql_jobs))
+        explain_tasks.add(task)
+        task.add_done_callback(explain_tasks.discard)
+
+async def current_data_version():
+    """data_version hiện tại (đọc lại DB tối đa mỗi DATA_VERSION_CHECK_SECONDS), đổi → xóa query_cache"""
+    now = asyncio.get_running_loop().time()
+    state = data_version_state
+    if state["checked_at"] and now - state["checked_at"] < DATA_VERSION_CHECK_SECONDS:
+        return state["version"]
+
+    try:
+        async with db_pool.acquire() as conn:
+            version = await conn.fetchval("SELECT version FROM data_version WHERE id = 1")
+    except asyncpg.UndefinedTableError:
+        # DB chưa chạy loader mới → không có data_version
+        version = None
+    if state["checked_at"] and version != state["version"]:
+        print(f"🧹 Data version {state['version']} → {version}: clear query cache")
+        query_cache.clear()
+    state["version"] = version
+    state["checked_at"] = now
+    return version
+
+async def load_suggest_indexes() -> dict:
+    """GROUP BY từng cột autocomplete trên df1_full/df2_full → {field: PrefixIndex}"""
+    jobs, fields = [], []
+    for field, columns in SUGGEST_COLUMNS.items():
+        for view, column in columns.items():
+            jobs.append(("fetch", f'SELECT "{column}" AS value, COUNT(*) AS n FROM {view} GROUP BY 1', []))
+            fields.append(field)
+    results = await run_concurrently(jobs)
+    return build_indexes(
+        (field, row["value"], row["n"]) for field, rows in zip(fields, results) for row in rows
+    )
+
+async def get_suggest_indexes() -> dict:
+    """Index autocomplete của data version hiện tại (load lại 1 lần khi version đổi)"""
+    version = await current_data_version()
+    state = suggest_state
+    if state["indexes"] is None or state["version"] != version:
+        async with suggest_lock:
+            if state["indexes"] is None or state["version"] != version:
+                start = asyncio.get_running_loop().time()
+                state["indexes"] = await load_suggest_indexes()
+                state["version"] = version
+                sizes = ", ".join(f"{f}={len(i):,}" for f, i in state["indexes"].items())
+                print(f"🔤 Suggest index loaded ({asyncio.get_running_loop().time() - start:.2f}s): {sizes}")
+    return state["indexes"]
+
+def query_cache_key(version, request, limit, count_mode, count_cap, tables, cursors, shape) -> str:
+    """Key chuẩn hóa: bỏ filter rỗng, trim text, sort list filter → request tương đương dùng chung cache"""
+    filters = {}
+    for name, val in (request.filters.model_dump() if request.filters else {}).items():
+        if isinstance(val, str):
+            val = val.strip()
+        elif isinstance(val, list):
+            val = sorted(v for v in val if v)
+        if val:
+            filters[name] = val
+    payload = {
+        "v": version,
+        "f": filters,
+        "s": [[r.column, r.order] for r in request.sort or []],
+        "l": limit,
+        "c": [count_mode, count_cap if count_mode == "capped" else None],
+        "t": sorted(tables),
+        "k": {t: cursors[t] for t in sorted(tables) if cursors.get(t)},
+        "r": shape,
+    }
+    return json.dumps(payload, ensure_ascii=False, sort_keys=True)
+
+def json_default(val):
+    """Kiểu orjson/json không tự encode: Decimal (NUMERIC) → str như clean_value, còn lại isoformat/str"""
+    if isinstance(val, Decimal):
+        return str(val)
+    if hasattr(val, 'isoformat'):
+        return val.isoformat()
+    return str(val)
+
+def encode_json(content) -> bytes:
+    """
+    Encode thẳng sang bytes: orjson xử lý date/datetime native (ISO, giống clean_value),
+    Decimal qua json_default → không cần clean_records dựng lại dict từng row.
+    """
+    if orjson is not None:
+        return orjson.dumps(content, default=json_default)
+    return json.dumps(content, default=json_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def dict_encode_columns(columns: list, rows: list) -> dict:
+    """
+    Cột text lặp nhiều (Xuất xứ, Đơn vị tính, Địa điểm...) → giá trị gửi 1 lần trong dicts[i],
+    row chỉ chứa index. Chỉ encode cột mà số giá trị khác nhau <= 1/2 số row.
+    """
+    if not rows:
+        return {"columns": columns, "dicts": {}, "rows": []}
+
+    col_values = [list(vals) for vals in zip(*rows)]
+    dicts = {}
+    for i, vals in enumerate(col_values):
+        if not all(v is None or isinstance(v, str) for v in vals):
+            continue
+        index = {}
+        for v in vals:
+            if v is not None and v not in index:
+                index[v] = len(index)
+        if not index or len(index) * 2 > len(vals):
+            continue
+        col_values[i] = [None if v is None else index[v] for v in vals]
+        dicts[str(i)] = list(index)
+
+    return {"columns": columns, "dicts": dicts, "rows": list(zip(*col_values))}
+
+def encode_rows(rows, shape: str = "rows") -> dict:
+    """
+    asyncpg Records → payload:
+    - "rows":     {"data": [{col: val}, ...]}  (mặc định, như cũ)
+    - "columnar": {"columns": [...], "rows": [[...], ...]}  tên cột gửi 1 lần
+    - "dict":     columnar + {"dicts": {"i": [giá trị]}}, cột i trong rows là index vào dicts["i"]
+    """
+    if shape in ("columnar", "dict"):
+        columns = list(rows[0].keys()) if rows else []
+        values = [tuple(r) for r in rows]
+        if shape == "dict":
+            return dict_encode_columns(columns, values)
+        return {"columns": columns, "rows": values}
+    return {"data": [dict(r) for r in rows]}
+
 def clean_value(val):
     """Clean giá trị để JSON serializable"""
     if val is None:
@@ -139,13 +470,15 @@ def clean_records(records):
     
 #     return result
 
-def parse_search_query(query_text: str):            # vd: viên nén OR viên nang = "viên nén" OR "viên nang"
+def parse_search_query(query_text: str, normalize: bool = False):   # vd: viên nén OR viên nang = "viên nén" OR "viên nang"
     """
     Parse search query with operators:
     - +term: must have term
     - -term: must not have term
     - "phrase": exact phrase (kept as phrase)
     - A OR B: OR between phrases (A and B can contain spaces without quotes)
+
+    normalize=True: fold mọi term giống cột norm_* (bỏ dấu, lowercase, gộp khoảng trắng)
     """
     if not query_text or not query_text.strip():
         return None
@@ -222,8 +555,53 @@ def parse_search_query(query_text: str):            # vd: viên nén OR viên na
         result["must_have"] = [placeholders.get(x, x) for x in result["must_have"]]
         result["must_not_have"] = [placeholders.get(x, x) for x in result["must_not_have"]]
 
+    if normalize:
+        for key, terms in result.items():
+            result[key] = [t for t in (fold_text(x) for x in terms) if t]
+
     return result
 
+def like_condition(column: str, param_name: str, negate: bool = False, normalized: bool = False) -> str:
+    """Predicate LIKE: cột norm_* đã fold sẵn (mode trgm) hoặc LOWER() kiểu cũ"""
+    op = "NOT LIKE" if negate else "LIKE"
+    if normalized:
+        # Cột norm_* đã fold sẵn → LIKE trực tiếp, planner dùng GIN gin_trgm_ops index
+        return f'{column} {op} ${param_name}'
+    return f'LOWER({column}) {op} LOWER(${param_name})'
+
+def like_array_condition(column: str, param_name: str, quantifier: str, negate: bool = False,
+                         normalized: bool = False) -> str:
+    """Predicate LIKE ANY/ALL trên 1 param text[] (pattern đã fold hoặc đã lower ở Python)"""
+    op = "NOT LIKE" if negate else "LIKE"
+    target = column if normalized else f'LOWER({column})'
+    return f'{target} {op} {quantifier}(${param_name}::text[])'
+
+def add_param(params: dict, param_counter: list, value) -> str:
+    param_name = f"p{param_counter[0]}"
+    param_counter[0] += 1
+    params[param_name] = value
+    return param_name
+
+def build_array_search_condition(column: str, parsed: dict, params: dict, param_counter: list,
+                                 normalize: bool):
+    """SEARCH_ARRAY_PARAMS: mỗi nhóm term (must/exclude/OR) = 1 param text[]"""
+    def patterns(terms):
+        return [f"%{t}%" if normalize else f"%{t.lower()}%" for t in terms]
+
+    conditions = []
+    must = parsed['must_have'] + parsed['phrases']
+    if must:
+        p = add_param(params, param_counter, patterns(must))
+        conditions.append(like_array_condition(column, p, "ANY", normalized=normalize))
+        conditions.append(like_array_condition(column, p, "ALL", normalized=normalize))
+    if parsed['must_not_have']:
+        p = add_param(params, param_counter, patterns(parsed['must_not_have']))
+        conditions.append(like_array_condition(column, p, "ALL", negate=True, normalized=normalize))
+    if parsed['should_have']:
+        p = add_param(params, param_counter, patterns(parsed['should_have']))
+        conditions.append(like_array_condition(column, p, "ANY", normalized=normalize))
+    return ' AND '.join(conditions) if conditions else None
+
 def build_text_search_condition(column: str, query_text: str, params: dict, param_counter: list):
     """
     Build PostgreSQL text search condition
@@ -231,10 +609,15 @@ def build_text_search_condition(column: str, query_text: str, params: dict, para
     """
     if not query_text:
         return None
-    
-    parsed = parse_search_query(query_text)
+
+    normalize = SEARCH_MODE != "like" and column in SEARCH_NORM_COLUMNS
+    parsed = parse_search_query(query_text, normalize=normalize)
     if not parsed:
         return None
+    if normalize:
+        column = SEARCH_NORM_COLUMNS[column]
+    if SEARCH_ARRAY_PARAMS:
+        return build_array_search_condition(column, parsed, params, param_counter, normalize)
     
     conditions = []
     
@@ -243,14 +626,14 @@ def build_text_search_condition(column: str, query_text: str, params: dict, para
         param_name = f"p{param_counter[0]}"
         param_counter[0] += 1
         params[param_name] = f"%{term}%"
-        conditions.append(f'LOWER({column}) LIKE LOWER(${param_name})')
+        conditions.append(like_condition(column, param_name, normalized=normalize))
     
     # Must not have terms
     for term in parsed['must_not_have']:
         param_name = f"p{param_counter[0]}"
         param_counter[0] += 1
         params[param_name] = f"%{term}%"
-        conditions.append(f'LOWER({column}) NOT LIKE LOWER(${param_name})')
+        conditions.append(like_condition(column, param_name, negate=True, normalized=normalize))
     
     # Should have terms (OR)
     if parsed['should_have']:
@@ -259,7 +642,7 @@ def build_text_search_condition(column: str, query_text: str, params: dict, para
             param_name = f"p{param_counter[0]}"
             param_counter[0] += 1
             params[param_name] = f"%{term}%"
-            or_conditions.append(f'LOWER({column}) LIKE LOWER(${param_name})')
+            or_conditions.append(like_condition(column, param_name, normalized=normalize))
         if or_conditions:
             conditions.append(f"({' OR '.join(or_conditions)})")
     
@@ -268,20 +651,20 @@ def build_text_search_condition(column: str, query_text: str, params: dict, para
         param_name = f"p{param_counter[0]}"
         param_counter[0] += 1
         params[param_name] = f"%{phrase}%"
-        conditions.append(f'LOWER({column}) LIKE LOWER(${param_name})')
+        conditions.append(like_condition(column, param_name, normalized=normalize))
     
     return ' AND '.join(conditions) if conditions else None
 
+_NAMED_PARAM = re.compile(r"\$(p\d+)\b")
+
 def replace_params(query: str, params: dict) -> tuple[str, list]:
-    """Thay $pN → $1, $2... và trả positional params"""
-    param_values = []
-    query_pos = query
-    
-    for i, (key, value) in enumerate(params.items(), 1):
-        query_pos = query_pos.replace(f'${key}', f'${i}')
-        param_values.append(value)
-    
-    return query_pos, param_values
+    """
+    Thay $pN → $1, $2... (theo thứ tự params) trong 1 lần quét và trả positional params.
+    Cùng tổ hợp filter → cùng text SQL → asyncpg dùng lại prepared statement của connection.
+    """
+    positions = {key: i for i, key in enumerate(params, 1)}
+    query_pos = _NAMED_PARAM.sub(lambda m: f"${positions[m.group(1)]}", query)
+    return query_pos, list(params.values())
 
 # base mapping (áp dụng chung cho cả df1_full, df2_full)
 BASE_SORT_MAP = {
@@ -311,13 +694,251 @@ ALLOWED_SORT_DF2 = {
     "drugName": '"Tên hàng hóa"'
 }
 
-def build_df1_query(filters: FilterRequest, sort_rules: List[SortRule], limit: int):
-    """Query df1_full VIEW - SIÊU GỌN!"""
-    query = 'SELECT * FROM df1_full'
+# Cột trả về client (bỏ cột norm_* chỉ dùng cho search)
+AI_SELECT_COLUMNS = [
+    "Chủ đầu tư", "Quyết định phê duyệt", "Ngày phê duyệt", "Ngày hết hiệu lực",
+    "Địa điểm", "Hình thức LCNT", "Tình trạng hiệu lực",
+]
+
+DF1_SELECT_COLUMNS = [
+    "id", "Mã TBMT", "Tên thuốc", "Tên hoạt chất", "Nồng độ, hàm lượng", "Đường dùng",
+    "Dạng bào chế", "Quy cách", "Nhóm thuốc", "GĐKLH hoặc GPNK", "Cơ sở sản xuất",
+    "Xuất xứ", "Đơn vị tính", "Số lượng", "Đơn giá trúng thầu (VND)", "Thành tiền (VND)",
+    "Nhà thầu trúng thầu", "Hạn dùng (tuổi thọ)", "created_at",
+    *AI_SELECT_COLUMNS,
+]
+
+DF2_SELECT_COLUMNS = [
+    "id", "Mã TBMT", "Tên hàng hóa", "Nhãn hiệu", "Ký mã hiệu", "Tính năng kỹ thuật",
+    "Xuất xứ", "Hãng sản xuất", "Đơn vị tính", "Khối lượng", "Đơn giá trúng thầu (VND)",
+    "Thành tiền (VND)", "Nhà thầu trúng thầu", "search", "created_at",
+    *AI_SELECT_COLUMNS,
+]
+
+DF1_SELECT = ", ".join(f'"{c}"' for c in DF1_SELECT_COLUMNS)
+DF2_SELECT = ", ".join(f'"{c}"' for c in DF2_SELECT_COLUMNS)
+# /api/df1, /api/df2 đọc thẳng bảng gốc (không có cột ai.*)
+DF1_TABLE_SELECT = ", ".join(f'"{c}"' for c in DF1_SELECT_COLUMNS if c not in AI_SELECT_COLUMNS)
+DF2_TABLE_SELECT = ", ".join(f'"{c}"' for c in DF2_SELECT_COLUMNS if c not in AI_SELECT_COLUMNS)
+
+def build_count_query(base_query: str, count_mode: str = "exact", count_cap: int = COUNT_CAP,
+                      params: dict = None, param_counter: list = None) -> Optional[str]:
+    """
+    Count query (trên base query chưa ORDER BY/LIMIT) theo count_mode, None nếu mode 'none'.
+    Có params/param_counter → cap là param (mọi countCap dùng chung 1 text SQL)
+    """
+    if count_mode == "none":
+        return None
+    if count_mode == "estimate":
+        return f'EXPLAIN (FORMAT JSON) {base_query}'
+    if count_mode == "capped":
+        # LIMIT không ORDER BY → Postgres dừng scan ngay khi đủ cap + 1 row
+        cap = count_cap + 1
+        if params is not None:
+            p = f"p{param_counter[0]}"; param_counter[0] += 1
+            params[p] = cap
+            cap = f'${p}'
+        return f'SELECT COUNT(*) FROM ({base_query} LIMIT {cap}) AS subq'
+    return f'SELECT COUNT(*) FROM ({base_query}) AS subq'
+
+def parse_count_result(value, count_mode: str, count_cap: int = COUNT_CAP) -> dict:
+    """Kết quả count query → {count, countMode, countCapped}"""
+    if count_mode == "none" or value is None:
+        return {"count": None, "countMode": count_mode, "countCapped": False}
+
+    if count_mode == "estimate":
+        plan = json.loads(value) if isinstance(value, str) else value
+        estimate = int(plan[0]["Plan"]["Plan Rows"])
+        return {"count": estimate, "countMode": count_mode, "countCapped": False}
+
+    total = int(value)
+    if count_mode == "capped" and total > count_cap:
+        return {"count": count_cap, "countMode": count_mode, "countCapped": True}
+    return {"count": total, "countMode": count_mode, "countCapped": False}
+
+# ========== KEYSET PAGINATION ==========
+# Cursor = base64(JSON {sort signature, giá trị các sort key của row cuối trang}).
+# Trang sau lọc WHERE (k1, k2, ..., id) "sau" cursor theo đúng ORDER BY → trang sâu
+# dùng index/top-N như trang đầu thay vì OFFSET.
+DEFAULT_ORDER_KEYS = [
+    ('"Ngày phê duyệt"', True, True),   # (cột, desc, nulls_last)
+    ('"Mã TBMT"', False, True),
+]
+TIEBREAK_KEY = ('"id"', False, True)
+# Cột sort không bao giờ NULL → keyset bỏ nhánh "OR col IS NULL" (để index dùng được làm bound)
+NOT_NULL_SORT_COLUMNS = {TIEBREAK_KEY[0]}
+
+DATE_COLUMNS = {"Ngày phê duyệt", "Ngày hết hiệu lực"}
+NUMERIC_COLUMNS = {"Số lượng", "Khối lượng", "Đơn giá trúng thầu (VND)", "Thành tiền (VND)"}
+
+def parse_date_filter(value: str) -> date:
+    """'YYYY-MM-DD...' → date (param kiểu DATE của prepared statement). ValueError → 400"""
+    try:
+        return date.fromisoformat(value.strip()[:10])
+    except ValueError:
+        raise ValueError(f"Invalid date: {value}")
+
+def build_order_keys(sort_rules: List[SortRule], allowed_sort: dict) -> list:
+    """Sort rules → [(cột, desc, nulls_last)], luôn kết thúc bằng id để thứ tự duy nhất"""
+    keys = []
+    for r in sort_rules or []:
+        col = allowed_sort.get(r.column)
+        if not col:
+            continue
+        desc = r.order == "desc"
+        # Giữ mặc định Postgres: ASC → NULLS LAST, DESC → NULLS FIRST
+        keys.append((col, desc, not desc))
+    return (keys or list(DEFAULT_ORDER_KEYS)) + [TIEBREAK_KEY]
+
+def order_by_sql(order_keys: list) -> str:
+    return ', '.join(
+        f'{col} {"DESC" if desc else "ASC"} NULLS {"LAST" if nulls_last else "FIRST"}'
+        for col, desc, nulls_last in order_keys
+    )
+
+def order_signature(order_keys: list) -> str:
+    return order_by_sql(order_keys)
+
+def encode_cursor_value(val):
+    if val is None or isinstance(val, (int, str)):
+        return val
+    if hasattr(val, 'isoformat'):
+        return val.isoformat()
+    return str(val)
+
+def decode_cursor_value(column: str, val):
+    if val is None:
+        return None
+    name = column.strip('"')
+    if name in DATE_COLUMNS:
+        return date.fromisoformat(val[:10])
+    if name in NUMERIC_COLUMNS:
+        return Decimal(val)
+    if name == "id":
+        return int(val)
+    return val
+
+def encode_cursor(order_keys: list, row) -> str:
+    payload = {
+        "s": order_signature(order_keys),
+        "v": [encode_cursor_value(row[col.strip('"')]) for col, _, _ in order_keys],
+    }
+    raw = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+def decode_cursor(cursor: str, order_keys: list) -> list:
+    """Cursor → giá trị sort keys. ValueError nếu cursor hỏng hoặc không khớp sort hiện tại"""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        values = payload["v"]
+        signature = payload["s"]
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if signature != order_signature(order_keys) or len(values) != len(order_keys):
+        raise ValueError("Cursor does not match current sort")
+    return [decode_cursor_value(col, v) for (col, _, _), v in zip(order_keys, values)]
+
+def build_keyset_condition(order_keys: list, values: list, params: dict, param_counter: list) -> str:
+    """
+    Row "sau" cursor theo ORDER BY (hỗ trợ trộn ASC/DESC + NULLS FIRST/LAST):
+    (k1 sau v1) OR (k1 = v1 AND k2 sau v2) OR ...
+    """
+    or_parts = []
+    equals = []
+
+    for (col, desc, nulls_last), val in zip(order_keys, values):
+        if val is None:
+            # NULLS LAST: không có gì sau NULL; NULLS FIRST: mọi giá trị non-null đều sau
+            after = None if nulls_last else f'{col} IS NOT NULL'
+            equal = f'{col} IS NULL'
+        else:
+            p = f"p{param_counter[0]}"; param_counter[0] += 1
+            params[p] = val
+            after = f'{col} {"<" if desc else ">"} ${p}'
+            if nulls_last and col not in NOT_NULL_SORT_COLUMNS:
+                after = f'({after} OR {col} IS NULL)'
+            equal = f'{col} = ${p}'
+
+        if after:
+            or_parts.append(' AND '.join(equals + [after]))
+        equals.append(equal)
+
+    if not or_parts:
+        return 'FALSE'
+    return '(' + ' OR '.join(f'({part})' for part in or_parts) + ')'
+
+def build_keyset_clauses(order_keys: list, values: list, params: dict, param_counter: list):
+    """
+    Điều kiện "sau cursor" mà index (cột sort đầu, ..., id) dùng được làm range bound.
+    OR-expansion của build_keyset_condition đúng nhưng Postgres chỉ lọc từng row (Filter) khi đọc index
+    từ đầu → trang sâu tốn như OFFSET. Nên:
+    - sort key đầu non-null: thêm bound thừa k1 <= v1 (DESC) / k1 >= v1 (ASC);
+      mọi key cùng chiều và chỉ còn id tiebreak → row comparison (k1, id) > (v1, c)
+    - k1 NULLS LAST: row k1 NULL nằm sau mọi giá trị nhưng "OR k1 IS NULL" phá bound → nhánh riêng
+    Returns: (conditions nhánh chính, điều kiện nhánh row NULL hoặc None)
+    """
+    col, desc, nulls_last = order_keys[0]
+    if values[0] is None:
+        return [build_keyset_condition(order_keys, values, params, param_counter)], None
+    null_branch = f'{col} IS NULL' if nulls_last else None
+
+    rest = order_keys[1:]
+    if all(key[1] == desc and key[0] in NOT_NULL_SORT_COLUMNS for key in rest):
+        refs = []
+        for val in values:
+            p = f"p{param_counter[0]}"; param_counter[0] += 1
+            params[p] = val
+            refs.append(f'${p}')
+        cols = ', '.join(key[0] for key in order_keys)
+        return [f'({cols}) {"<" if desc else ">"} ({", ".join(refs)})'], null_branch
+
+    keyset = build_keyset_condition(order_keys, values, params, param_counter)
+    p = f"p{param_counter[0]}"; param_counter[0] += 1
+    params[p] = values[0]
+    return [keyset, f'{col} {"<=" if desc else ">="} ${p}'], null_branch
+
+def finalize_query(query: str, conditions: list, params: dict, param_counter: list,
+                   allowed_sort: dict, sort_rules: List[SortRule], limit: Optional[int],
+                   cursor: Optional[str] = None, count_mode: str = "exact",
+                   count_cap: int = COUNT_CAP):
+    """
+    WHERE + keyset cursor + ORDER BY + LIMIT (lấy limit + 1 row để biết còn trang sau,
+    limit=None → không LIMIT, dùng cho export stream)
+    Returns: (query, params, count_query, count_params, order_keys)
+    """
+    def where(conds):
+        return ' WHERE ' + ' AND '.join(conds) if conds else ''
+
+    # Count không phụ thuộc cursor → chỉ dùng params của filter
+    count_params = dict(params)
+    count_query = build_count_query(query + where(conditions), count_mode, count_cap, count_params, param_counter)
+
+    order_keys = build_order_keys(sort_rules, allowed_sort)
+    tail = ' ORDER BY ' + order_by_sql(order_keys)
+    if limit is not None:
+        # LIMIT là param → mọi page size dùng chung 1 text SQL (prepared statement cache của asyncpg)
+        p = f"p{param_counter[0]}"; param_counter[0] += 1
+        params[p] = limit + 1
+        tail += f' LIMIT ${p}'
+
+    if not cursor:
+        return query + where(conditions) + tail, params, count_query, count_params, order_keys
+
+    values = decode_cursor(cursor, order_keys)
+    keyset, null_branch = build_keyset_clauses(order_keys, values, params, param_counter)
+    page_query = query + where(conditions + keyset) + tail
+    if null_branch:
+        # Mỗi nhánh tự ORDER BY + LIMIT theo index, gộp lại ≤ 2 × (limit + 1) row
+        null_query = query + where(conditions + [null_branch]) + tail
+        page_query = f'SELECT * FROM (({page_query}) UNION ALL ({null_query})) AS page' + tail
+
+    return page_query, params, count_query, count_params, order_keys
+
+def build_df1_conditions(filters: FilterRequest):
+    """WHERE conditions + params của filter df1_full (dùng chung cho query, export, aggregate)"""
     conditions = []
     params = {}
     param_counter = [1]
-    allowed_sort = ALLOWED_SORT_DF1
 
     if filters:
         # ✅ Text filters (có sẵn trong VIEW)
@@ -363,47 +984,29 @@ def build_df1_query(filters: FilterRequest, sort_rules: List[SortRule], limit: i
         # Date range
         if filters.dateFrom:
             p = f"p{param_counter[0]}"; param_counter[0] += 1
-            params[p] = filters.dateFrom
+            params[p] = parse_date_filter(filters.dateFrom)
             conditions.append(f'"Ngày phê duyệt" >= ${p}')
 
         if filters.dateTo:
             p = f"p{param_counter[0]}"; param_counter[0] += 1
-            params[p] = filters.dateTo
+            params[p] = parse_date_filter(filters.dateTo)
             conditions.append(f'"Ngày phê duyệt" <= ${p}')
 
-    if conditions:
-        query += ' WHERE ' + ' AND '.join(conditions)
-
-    # ===== ORDER BY =====
-    default_order = ' ORDER BY "Ngày phê duyệt" DESC NULLS LAST, "Mã TBMT" ASC'
-
-    order_clauses = []
-    if sort_rules:
-        for r in sort_rules:
-            col = allowed_sort.get(r.column)
-            if not col:
-                continue
-            direction = "DESC" if r.order == "desc" else "ASC"
-            order_clauses.append(f"{col} {direction}")
-
-    if order_clauses:
-        query += ' ORDER BY ' + ', '.join(order_clauses)
-    else:
-        query += default_order
-
-    query += f' LIMIT {limit}'
-
-    base_query = re.sub(r' ORDER BY .*? LIMIT \d+$', '', query)
-    count_query = f'SELECT COUNT(*) FROM ({base_query}) AS subq'
+    return conditions, params, param_counter
 
-    return query, params, count_query
+def build_df1_query(filters: FilterRequest, sort_rules: List[SortRule], limit: int,
+                    count_mode: str = "exact", count_cap: int = COUNT_CAP, cursor: Optional[str] = None):
+    """Query df1_full VIEW - SIÊU GỌN!"""
+    query = f'SELECT {DF1_SELECT} FROM df1_full'
+    conditions, params, param_counter = build_df1_conditions(filters)
+    return finalize_query(query, conditions, params, param_counter, ALLOWED_SORT_DF1, sort_rules,
+                          limit, cursor, count_mode, count_cap)
 
-def build_df2_query(filters: FilterRequest, sort_rules: List[SortRule], limit: int):
-    query = 'SELECT * FROM df2_full'
+def build_df2_conditions(filters: FilterRequest):
+    """WHERE conditions + params của filter df2_full (dùng chung cho query, export, aggregate)"""
     conditions = []
     params = {}
     param_counter = [1]
-    allowed_sort = ALLOWED_SORT_DF2
 
     if filters:
         # ===== 1) Nhóm field phải search trên cột "search" (concat) =====
@@ -458,40 +1061,22 @@ def build_df2_query(filters: FilterRequest, sort_rules: List[SortRule], limit: i
 
         if filters.dateFrom:
             p = f"p{param_counter[0]}"; param_counter[0] += 1
-            params[p] = filters.dateFrom
+            params[p] = parse_date_filter(filters.dateFrom)
             conditions.append(f'"Ngày phê duyệt" >= ${p}')
 
         if filters.dateTo:
             p = f"p{param_counter[0]}"; param_counter[0] += 1
-            params[p] = filters.dateTo
+            params[p] = parse_date_filter(filters.dateTo)
             conditions.append(f'"Ngày phê duyệt" <= ${p}')
 
-    if conditions:
-        query += ' WHERE ' + ' AND '.join(conditions)
-
-    # ===== ORDER BY =====
-    default_order = ' ORDER BY "Ngày phê duyệt" DESC NULLS LAST, "Mã TBMT" ASC'
-
-    order_clauses = []
-    if sort_rules:
-        for r in sort_rules:
-            col = allowed_sort.get(r.column)
-            if not col:
-                continue
-            direction = "DESC" if r.order == "desc" else "ASC"
-            order_clauses.append(f"{col} {direction}")
+    return conditions, params, param_counter
 
-    if order_clauses:
-        query += ' ORDER BY ' + ', '.join(order_clauses)
-    else:
-        query += default_order
-
-    query += f' LIMIT {limit}'
-
-    base_query = re.sub(r' ORDER BY .*? LIMIT \d+$', '', query)
-    count_query = f'SELECT COUNT(*) FROM ({base_query}) AS subq'
-
-    return query, params, count_query
+def build_df2_query(filters: FilterRequest, sort_rules: List[SortRule], limit: int,
+                    count_mode: str = "exact", count_cap: int = COUNT_CAP, cursor: Optional[str] = None):
+    query = f'SELECT {DF2_SELECT} FROM df2_full'
+    conditions, params, param_counter = build_df2_conditions(filters)
+    return finalize_query(query, conditions, params, param_counter, ALLOWED_SORT_DF2, sort_rules,
+                          limit, cursor, count_mode, count_cap)
 
 
 # ========== LIFESPAN ==========
@@ -516,6 +1101,12 @@ async def lifespan(app: FastAPI):
     except Exception as e:
         print(f"❌ Database connection failed: {e}")
         raise
+
+    try:
+        await get_suggest_indexes()
+    except Exception as e:
+        # Không chặn startup: /api/suggest sẽ thử load lại ở request đầu tiên
+        print(f"⚠️ Suggest index not loaded: {e}")
     
     print("=" * 60)
     print("✅ SERVER READY")
@@ -547,6 +1138,7 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(GZipMiddleware, minimum_size=GZIP_MIN_SIZE, compresslevel=GZIP_LEVEL)
 
 # @app.get("/")
 # def root():
@@ -571,6 +1163,46 @@ async def health():
     return Response(status_code=200)
 
 
+@app.get("/api/cache")
+async def cache_stats():
+    """Hit/miss của cache /api/query"""
+    return {"dataVersion": data_version_state["version"], **query_cache.stats()}
+
+
+@app.get("/api/metrics")
+async def get_metrics():
+    """Histogram latency /api/query theo từng bước, pool utilization, query chậm gần nhất, cache stats"""
+    return Response(
+        content=encode_json({
+            "success": True,
+            **metrics.snapshot(),
+            "pool": pool_stats(),
+            "cache": query_cache.stats(),
+            "slowQueryMs": SLOW_QUERY_MS,
+            "explainEnabled": SLOW_QUERY_EXPLAIN,
+        }),
+        media_type="application/json",
+    )
+
+@app.get("/api/suggest")
+async def suggest_values(field: str = Query(...), q: str = Query(""), limit: int = Query(20)):
+    """Gợi ý giá trị filter theo prefix (không dấu), trả từ index trong RAM"""
+    if field not in SUGGEST_COLUMNS:
+        return JSONResponse(status_code=400, content={"success": False, "error": f"Unsupported field: {field}"})
+    try:
+        indexes = await get_suggest_indexes()
+    except Exception as e:
+        print(f"❌ Suggest error: {e}")
+        return JSONResponse(status_code=500, content={"success": False, "error": str(e)})
+
+    index = indexes.get(field)
+    limit = min(max(limit, 1), MAX_SUGGESTIONS)
+    return JSONResponse(content={
+        "success": True,
+        "field": field,
+        "suggestions": index.search(q, limit) if index else [],
+    })
+
 @app.get("/api/metadata")
 async def get_metadata():
     """Trả về metadata"""
@@ -623,7 +1255,7 @@ async def get_metadata():
 async def get_df1():
     """Get tất cả df1 (backward compatible)"""
     try:
-        query = 'SELECT * FROM df1_standard ORDER BY created_at DESC, "Mã TBMT" ASC LIMIT 1000'
+        query = f'SELECT {DF1_TABLE_SELECT} FROM df1_standard ORDER BY created_at DESC, "Mã TBMT" ASC LIMIT 1000'
         
         async with db_pool.acquire() as conn:
             rows = await conn.fetch(query)
@@ -646,7 +1278,7 @@ async def get_df1():
 async def get_df2():
     """Get tất cả df2 (backward compatible)"""
     try:
-        query = 'SELECT * FROM df2_extended ORDER BY "Ngày phê duyệt" DESC LIMIT 1000'
+        query = f'SELECT {DF2_TABLE_SELECT} FROM df2_extended ORDER BY "Ngày phê duyệt" DESC LIMIT 1000'
         
         async with db_pool.acquire() as conn:
             rows = await conn.fetch(query)
@@ -666,52 +1298,470 @@ async def get_df2():
         )
 
 # ========== NEW ENDPOINTS (With filter/sort) ==========
+RESPONSE_SHAPES = ("rows", "columnar", "dict")
+
+QUERY_BUILDERS = {
+    "df1": build_df1_query,
+    "df2": build_df2_query,
+}
+
 @app.post("/api/query")
 async def query_data(request: QueryRequest):
+    timer = RequestTimer()
     try:
-        limit = request.limit or 200
+        limit = min(max(request.limit or 200, 1), MAX_QUERY_LIMIT)
+        count_mode = request.countMode if request.countMode in COUNT_MODES else "exact"
+        count_cap = request.countCap if request.countCap and request.countCap > 0 else COUNT_CAP
+        cursors = request.cursors or {}
+        tables = [t for t in (request.tables or QUERY_BUILDERS) if t in QUERY_BUILDERS]
+        shape = request.shape if request.shape in RESPONSE_SHAPES else "rows"
+
+        # Cache: trả thẳng bytes JSON đã serialize nếu request tương đương đã chạy với cùng data version
+        cache_key = None
+        if query_cache.enabled:
+            version = await current_data_version()
+            cache_key = query_cache_key(version, request, limit, count_mode, count_cap, tables, cursors, shape)
+            body = query_cache.get(cache_key)
+            if body is not None:
+                metrics.observe("query.cacheHit", timer.elapsed)
+                return Response(content=body, media_type="application/json", headers={"X-Cache": "HIT"})
         
         # Build queries
-        q1, p1, cq1 = build_df1_query(request.filters or FilterRequest(), request.sort or [], limit)
-        q2, p2, cq2 = build_df2_query(request.filters or FilterRequest(), request.sort or [], limit)
-        
-        print(f"📊 Query DF1: {q1[:200]}...")
-        print(f"📊 Query DF2: {q2[:200]}...")
-        
-        # ✅ DATA: thay params → execute
-        q1_pos, data1_params = replace_params(q1, p1)
-        q2_pos, data2_params = replace_params(q2, p2)
+        built = {}
+        with timer.stage("build"):
+            for table in tables:
+                built[table] = QUERY_BUILDERS[table](
+                    request.filters or FilterRequest(), request.sort or [], limit,
+                    count_mode, count_cap, cursors.get(table)
+                )
+                print(f"📊 Query {table.upper()}: {built[table][0][:200]}...")
         
+            # ✅ DATA + COUNT: thay params → execute song song (mỗi query 1 connection)
+            jobs, job_names = [], []
+            for table in tables:
+                query, params, count_query, count_params, _ = built[table]
+                jobs.append(("fetch", *replace_params(query, params)))
+                job_names.append(f"{table}.data")
+                if count_query:
+                    jobs.append(("fetchval", *replace_params(count_query, count_params)))
+                    job_names.append(f"{table}.count")
+
+        timings = []
+        results = iter(await run_concurrently(jobs, timings=timings))
+        for name, (acquire_secs, query_secs) in zip(job_names, timings):
+            timer.add("acquire", acquire_secs)
+            timer.add(name, query_secs)
+
+        with timer.stage("serialize"):
+            content = {"success": True}
+            for table in tables:
+                _, _, count_query, _, order_keys = built[table]
+                rows = next(results)
+                total = next(results) if count_query else None
+
+                # Lấy limit + 1 row: có row thừa → còn trang sau, cursor = row cuối của trang này
+                next_cursor = encode_cursor(order_keys, rows[limit - 1]) if len(rows) > limit else None
+                page = rows[:limit]
+
+                content[table] = {
+                    **encode_rows(page, shape),
+                    **parse_count_result(total, count_mode, count_cap),
+                    "displayed": len(page),
+                    "nextCursor": next_cursor,
+                }
+
+            body = encode_json(content)
+        record_query_timing(timer, request, tables,
+                            [(name, sql, params) for name, (_, sql, params) in zip(job_names, jobs)])
+        headers = {}
+        if cache_key is not None:
+            query_cache.put(cache_key, body)
+            headers["X-Cache"] = "MISS"
+        return Response(content=body, media_type="application/json", headers=headers)
+    except ValueError as e:
+        # Cursor hỏng / không khớp sort hiện tại
+        return JSONResponse(status_code=400, content={"success": False, "error": str(e)})
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        import traceback; traceback.print_exc()
+        return JSONResponse(status_code=500, content={"success": False, "error": str(e)})
+
+
+# ========== AGGREGATE (thống kê giá trên toàn bộ kết quả filter) ==========
+AGG_DEFAULT_PERCENTILES = [0.25, 0.5, 0.75]
+MAX_AGG_GROUPS = int(os.getenv("MAX_AGG_GROUPS", "1000"))
+MAX_AGG_GROUP_BY = 4
+MAX_AGG_PERCENTILES = 9
+
+APPROVAL_MONTH = 'date_trunc(\'month\', "Ngày phê duyệt")::date'
+
+ALLOWED_GROUP_DF1 = {
+    **ALLOWED_SORT_DF1,
+    "activeIngredient": '"Tên hoạt chất"',
+    "concentration": '"Nồng độ, hàm lượng"',
+    "route": '"Đường dùng"',
+    "dosageForm": '"Dạng bào chế"',
+    "drugGroup": '"Nhóm thuốc"',
+    "manufacturer": '"Cơ sở sản xuất"',
+    "selectionMethod": '"Hình thức LCNT"',
+    "approvalMonth": APPROVAL_MONTH,
+}
+
+ALLOWED_GROUP_DF2 = {
+    **ALLOWED_SORT_DF2,
+    "brand": '"Nhãn hiệu"',
+    "model": '"Ký mã hiệu"',
+    "manufacturer": '"Hãng sản xuất"',
+    "selectionMethod": '"Hình thức LCNT"',
+    "approvalMonth": APPROVAL_MONTH,
+}
+
+AGG_SOURCES = {
+    # table: (view, build conditions, group-by map, cột số lượng)
+    "df1": ("df1_full", build_df1_conditions, ALLOWED_GROUP_DF1, '"Số lượng"'),
+    "df2": ("df2_full", build_df2_conditions, ALLOWED_GROUP_DF2, '"Khối lượng"'),
+}
+
+def build_aggregate_query(request: AggregateRequest):
+    """
+    GROUP BY các key được chọn trên view đã filter → count, tổng thành tiền/số lượng,
+    min/avg/max + percentile_cont đơn giá. Returns: (query, params, group keys, percentiles, limit)
+    """
+    view, build_conditions, allowed_group, quantity_col = AGG_SOURCES[request.table]
+
+    keys = list(dict.fromkeys(request.groupBy or []))
+    unknown = [k for k in keys if k not in allowed_group]
+    if unknown:
+        raise ValueError(f"Unsupported groupBy: {', '.join(unknown)}")
+    if len(keys) > MAX_AGG_GROUP_BY:
+        raise ValueError(f"groupBy supports at most {MAX_AGG_GROUP_BY} keys")
+
+    percentiles = request.percentiles or AGG_DEFAULT_PERCENTILES
+    if len(percentiles) > MAX_AGG_PERCENTILES or not all(0 <= q <= 1 for q in percentiles):
+        raise ValueError(f"percentiles must be at most {MAX_AGG_PERCENTILES} values in [0, 1]")
+
+    limit = min(max(request.limit or 100, 1), MAX_AGG_GROUPS)
+    conditions, params, param_counter = build_conditions(request.filters or FilterRequest())
+    p = f"p{param_counter[0]}"; param_counter[0] += 1
+    params[p] = [float(q) for q in percentiles]
+
+    price = '"Đơn giá trúng thầu (VND)"'
+    select = [f'{allowed_group[k]} AS "{k}"' for k in keys] + [
+        'COUNT(*) AS "count"',
+        f'COUNT({price}) AS "priceCount"',
+        f'SUM("Thành tiền (VND)") AS "totalAmount"',
+        f'SUM({quantity_col}) AS "totalQuantity"',
+        f'MIN({price}) AS "minPrice"',
+        f'AVG({price}) AS "avgPrice"',
+        f'MAX({price}) AS "maxPrice"',
+        f'percentile_cont(${p}::float8[]) WITHIN GROUP (ORDER BY {price}::float8) AS "pricePercentiles"',
+    ]
+    query = f'SELECT {", ".join(select)} FROM {view}'
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    if keys:
+        positions = ", ".join(str(i) for i in range(1, len(keys) + 1))
+        query += f' GROUP BY {positions} ORDER BY "count" DESC, {positions} LIMIT {limit + 1}'
+    return query, params, keys, percentiles, limit
+
+@app.post("/api/aggregate")
+async def aggregate_data(request: AggregateRequest):
+    """Thống kê đơn giá/thành tiền theo nhóm trên toàn bộ kết quả filter (không bị giới hạn 200 row)"""
+    try:
+        if request.table not in AGG_SOURCES:
+            raise ValueError(f"Unsupported table: {request.table}")
+
+        query, params, keys, percentiles, limit = build_aggregate_query(request)
+
+        # Cùng cache với /api/query (xóa khi data version đổi)
+        cache_key = None
+        if query_cache.enabled:
+            version = await current_data_version()
+            cache_key = "agg:" + json.dumps(
+                {"v": version, "q": query, "p": list(params.values())},
+                ensure_ascii=False, default=json_default,
+            )
+            body = query_cache.get(cache_key)
+            if body is not None:
+                return Response(content=body, media_type="application/json", headers={"X-Cache": "HIT"})
+
+        query_pos, query_params = replace_params(query, params)
+        print(f"📈 Aggregate {request.table.upper()}: {query_pos[:200]}...")
         async with db_pool.acquire() as conn:
-            # Data queries
-            rows1 = await conn.fetch(q1_pos, *data1_params)
-            data1 = [dict(row) for row in rows1]
-            
-            rows2 = await conn.fetch(q2_pos, *data2_params)
-            data2 = [dict(row) for row in rows2]
-            
-            # ✅ COUNT: thay params → execute
-            cq1_pos, count1_params = replace_params(cq1, p1)
-            cq2_pos, count2_params = replace_params(cq2, p2)
-            
-            total1 = await conn.fetchval(cq1_pos, *count1_params)
-            total2 = await conn.fetchval(cq2_pos, *count2_params)
-        
-        return JSONResponse(content={
+            rows = await conn.fetch(query_pos, *query_params)
+
+        groups = []
+        for row in rows[:limit]:
+            group = dict(row)
+            quantiles = group.pop("pricePercentiles") or [None] * len(percentiles)
+            group["pricePercentiles"] = {str(q): v for q, v in zip(percentiles, quantiles)}
+            groups.append(group)
+
+        body = encode_json({
             "success": True,
-            "df1": {
-                "data": clean_records(data1), 
-                "count": int(total1),
-                "displayed": len(data1)
-            },
-            "df2": {
-                "data": clean_records(data2),
-                "count": int(total2), 
-                "displayed": len(data2)
-            }
+            "table": request.table,
+            "groupBy": keys,
+            "groups": groups,
+            "truncated": len(rows) > limit,
         })
+        headers = {}
+        if cache_key is not None:
+            query_cache.put(cache_key, body)
+            headers["X-Cache"] = "MISS"
+        return Response(content=body, media_type="application/json", headers=headers)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"success": False, "error": str(e)})
     except Exception as e:
-        print(f"❌ Error: {e}")
+        print(f"❌ Aggregate error: {e}")
         import traceback; traceback.print_exc()
         return JSONResponse(status_code=500, content={"success": False, "error": str(e)})
 
+
+# ========== FACETS (đếm theo Hình thức LCNT / Địa điểm / Xuất xứ / Tình trạng hiệu lực) ==========
+# Đọc từ facet_rollup (update_db.py build sẵn theo tháng phê duyệt) khi filter chỉ gồm các cột facet
+# + khoảng ngày tròn tháng; có text filter / ngày lẻ tháng → GROUP BY trực tiếp trên view.
+MAX_FACET_VALUES = int(os.getenv("MAX_FACET_VALUES", "500"))
+# Filter "của" từng facet: đếm facet nào thì bỏ filter của chính nó (đã chọn 1 địa điểm vẫn thấy
+# số row của các địa điểm khác để chọn thêm), mọi filter khác vẫn áp dụng
+FACET_OWN_FILTERS = {
+    "selectionMethod": "selectionMethod",
+    "place": "place",
+    "origin": "country",
+    "validity": "validity",
+}
+# Ngoài filter của chính facet, rollup chỉ trả lời được khoảng ngày (trọn tháng)
+ROLLUP_FILTERS = {"dateFrom", "dateTo"}
+
+FACET_VIEWS = {
+    "df1": ("df1_full", build_df1_conditions),
+    "df2": ("df2_full", build_df2_conditions),
+}
+
+def month_range(filters: FilterRequest):
+    """(tháng đầu, tháng cuối) nếu dateFrom là ngày 1 và dateTo là ngày cuối tháng; False nếu lẻ tháng"""
+    first = last = None
+    if filters.dateFrom:
+        first = parse_date_filter(filters.dateFrom)
+        if first.day != 1:
+            return False
+    if filters.dateTo:
+        last = parse_date_filter(filters.dateTo)
+        if (last + timedelta(days=1)).day != 1:
+            return False
+        last = last.replace(day=1)
+    return first, last
+
+def active_filters(filters: FilterRequest) -> set:
+    return {k for k, v in filters.model_dump().items() if (v.strip() if isinstance(v, str) else v)}
+
+def build_rollup_query(table: str, facets: list, months: tuple):
+    """Query facet_rollup cho các facet (đã bỏ filter của chính nó, chỉ còn khoảng tháng)"""
+    params = {"p1": table, "p2": facets}
+    param_counter = [3]
+    conditions = ["table_name = $p1", "facet = ANY($p2)"]
+    for value, condition in ((months[0], 'month >= $%s'), (months[1], 'month <= $%s')):
+        if value:
+            p = add_param(params, param_counter, value)
+            conditions.append(condition % p)
+    query = (f'SELECT facet, value, SUM(row_count)::bigint AS "count", SUM(total_amount) AS "totalAmount" '
+             f'FROM {FACET_ROLLUP} WHERE {" AND ".join(conditions)} GROUP BY facet, value')
+    return query, params
+
+def build_facet_query(source: str, conditions: list, facets: list, count_expr: str, amount_expr: str) -> str:
+    """1 lần quét cho nhiều facet: GROUP BY GROUPING SETS, GROUPING() cho biết row thuộc facet nào"""
+    cols = [f'"{FACET_COLUMNS[f]}"' for f in facets]
+    select = [f'GROUPING({c}) AS g{i}' for i, c in enumerate(cols)] + [
+        f'{c} AS v{i}' for i, c in enumerate(cols)
+    ] + [f'{count_expr} AS "count"', f'{amount_expr} AS "totalAmount"']
+    query = f'SELECT {", ".join(select)} FROM {source}'
+    if conditions:
+        query += ' WHERE ' + ' AND '.join(conditions)
+    query += ' GROUP BY GROUPING SETS (' + ', '.join(f'({c})' for c in cols) + ')'
+    return query
+
+def build_live_facet_queries(table: str, filters: FilterRequest, facets: list, active: set) -> list:
+    """
+    Đếm trên view: facet có filter của chính nó đang bật → query riêng (bỏ filter đó),
+    các facet còn lại dùng chung 1 query GROUPING SETS. Returns: [("live", facets, query, params)]
+    """
+    view, build_conditions = FACET_VIEWS[table]
+    groups = {}
+    for f in facets:
+        own = FACET_OWN_FILTERS[f]
+        groups.setdefault(own if own in active else None, []).append(f)
+    queries = []
+    for own, group in groups.items():
+        group_filters = filters.model_copy(update={own: None}) if own else filters
+        conditions, params, _ = build_conditions(group_filters)
+        query = build_facet_query(view, conditions, group, 'COUNT(*)', 'SUM("Thành tiền (VND)")')
+        queries.append(("live", group, query, params))
+    return queries
+
+def build_facet_queries(table: str, filters: FilterRequest, facets: list) -> list:
+    """Facet trả lời được bằng facet_rollup → 1 query rollup, còn lại đếm trên view"""
+    active = active_filters(filters)
+    months = month_range(filters)
+    rollup_facets = [] if months is False else [
+        f for f in facets if not active - {FACET_OWN_FILTERS[f]} - ROLLUP_FILTERS
+    ]
+    queries = []
+    if rollup_facets:
+        queries.append(("rollup", rollup_facets, *build_rollup_query(table, rollup_facets, months)))
+    live_facets = [f for f in facets if f not in rollup_facets]
+    if live_facets:
+        queries += build_live_facet_queries(table, filters, live_facets, active)
+    return queries
+
+def facet_values(source: str, facets: list, rows):
+    """Row rollup (facet, value) hoặc row GROUPING SETS (g{i}, v{i}) → (facet, {value, count, totalAmount})"""
+    for row in rows:
+        if not row["count"]:
+            continue
+        if source == "rollup":
+            facet, value = row["facet"], row["value"]
+        else:
+            i = next(i for i in range(len(facets)) if row[f"g{i}"] == 0)
+            facet, value = facets[i], row[f"v{i}"]
+        yield facet, {"value": value, "count": row["count"], "totalAmount": row["totalAmount"]}
+
+def group_facet_values(items, facets: list, sources: dict, limit: int) -> dict:
+    """(facet, value) → {facet: {values, truncated, source}} (nhiều row nhất trước, tối đa limit)"""
+    result = {f: [] for f in facets}
+    for facet, value in items:
+        result[facet].append(value)
+    for values in result.values():
+        values.sort(key=lambda v: (-v["count"], v["value"] is None, str(v["value"])))
+    return {f: {"values": v[:limit], "truncated": len(v) > limit, "source": sources[f]} for f, v in result.items()}
+
+@app.post("/api/facets")
+async def facet_counts(request: FacetRequest):
+    """Số row + tổng thành tiền theo từng giá trị facet, cho dashboard/filter sidebar"""
+    try:
+        filters = request.filters or FilterRequest()
+        tables = [t for t in (request.tables or FACET_VIEWS) if t in FACET_VIEWS]
+        facets = list(dict.fromkeys(request.facets or FACET_COLUMNS))
+        unknown = [f for f in facets if f not in FACET_COLUMNS]
+        if unknown:
+            raise ValueError(f"Unsupported facets: {', '.join(unknown)}")
+        limit = min(max(request.limit or 50, 1), MAX_FACET_VALUES)
+
+        queries = {table: build_facet_queries(table, filters, facets) for table in tables}
+
+        cache_key = None
+        if query_cache.enabled:
+            version = await current_data_version()
+            cache_key = "facets:" + json.dumps(
+                {"v": version, "q": [[q, list(p.values())] for qs in queries.values() for _, _, q, p in qs], "l": limit},
+                ensure_ascii=False, default=json_default,
+            )
+            body = query_cache.get(cache_key)
+            if body is not None:
+                return Response(content=body, media_type="application/json", headers={"X-Cache": "HIT"})
+
+        content = {"success": True}
+        for table, table_queries in queries.items():
+            items, sources = [], {}
+            for source, group, query, params in table_queries:
+                try:
+                    query_pos, query_params = replace_params(query, params)
+                    async with db_pool.acquire() as conn:
+                        rows = await conn.fetch(query_pos, *query_params)
+                    items += facet_values(source, group, rows)
+                except (asyncpg.UndefinedTableError, asyncpg.UndefinedColumnError):
+                    # DB load bằng bản cũ chưa có facet_rollup (hoặc layout cũ) → đếm trực tiếp trên view
+                    if source != "rollup":
+                        raise
+                    source = "live"
+                    for _, live_group, live_query, live_params in build_live_facet_queries(
+                            table, filters, group, active_filters(filters)):
+                        query_pos, query_params = replace_params(live_query, live_params)
+                        async with db_pool.acquire() as conn:
+                            rows = await conn.fetch(query_pos, *query_params)
+                        items += facet_values("live", live_group, rows)
+                sources.update(dict.fromkeys(group, source))
+            table_sources = set(sources.values())
+            print(f"🧮 Facets {table.upper()} ({'/'.join(sorted(table_sources))}): {len(items)} values")
+            content[table] = {
+                "source": table_sources.pop() if len(table_sources) == 1 else "mixed",
+                "facets": group_facet_values(items, facets, sources, limit),
+            }
+
+        body = encode_json(content)
+        headers = {}
+        if cache_key is not None:
+            query_cache.put(cache_key, body)
+            headers["X-Cache"] = "MISS"
+        return Response(content=body, media_type="application/json", headers=headers)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"success": False, "error": str(e)})
+    except Exception as e:
+        print(f"❌ Facets error: {e}")
+        import traceback; traceback.print_exc()
+        return JSONResponse(status_code=500, content={"success": False, "error": str(e)})
+
+
+# ========== EXPORT (stream toàn bộ kết quả) ==========
+EXPORT_COLUMNS = {
+    "df1": DF1_SELECT_COLUMNS,
+    "df2": DF2_SELECT_COLUMNS,
+}
+
+EXPORT_MEDIA_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson; charset=utf-8",
+}
+
+async def stream_export(query: str, params: list, columns: List[str], fmt: str):
+    """
+    Đọc kết quả bằng server-side cursor theo batch EXPORT_BATCH_SIZE row,
+    mỗi batch encode thành 1 chunk → memory không phụ thuộc số row.
+    """
+    async with db_pool.acquire() as conn:
+        # asyncpg cursor cần nằm trong transaction
+        async with conn.transaction():
+            cursor = await conn.cursor(query, *params)
+
+            if fmt == "csv":
+                buf = io.StringIO()
+                writer = csv.writer(buf)
+                buf.write("\ufeff")  # BOM để Excel đọc đúng tiếng Việt
+                writer.writerow(columns)
+                yield buf.getvalue()
+
+            while True:
+                rows = await cursor.fetch(EXPORT_BATCH_SIZE)
+                if not rows:
+                    break
+
+                if fmt == "csv":
+                    buf = io.StringIO()
+                    writer = csv.writer(buf)
+                    writer.writerows([clean_value(v) for v in row.values()] for row in rows)
+                    yield buf.getvalue()
+                else:
+                    yield b"".join(encode_json(dict(row)) + b"\n" for row in rows)
+
+@app.post("/api/export")
+async def export_data(request: QueryRequest, table: str = Query("df1"), fmt: str = Query("csv", alias="format")):
+    """Export toàn bộ kết quả filter/sort của 1 bảng (CSV hoặc NDJSON), stream từng batch"""
+    if table not in QUERY_BUILDERS or fmt not in EXPORT_MEDIA_TYPES:
+        return JSONResponse(
+            status_code=400,
+            content={"success": False, "error": f"Unsupported table/format: {table}/{fmt}"}
+        )
+
+    try:
+        query, params, _, _, _ = QUERY_BUILDERS[table](
+            request.filters or FilterRequest(), request.sort or [], None, "none"
+        )
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"success": False, "error": str(e)})
+    query_pos, query_params = replace_params(query, params)
+    print(f"📤 Export {table.upper()} ({fmt}): {query_pos[:200]}...")
+
+    filename = f"DuLieuTrungThau_{table}_{datetime.now().strftime('%Y%m%d_%H%M')}.{fmt}"
+    return StreamingResponse(
+        stream_export(query_pos, query_params, EXPORT_COLUMNS[table], fmt),
+        media_type=EXPORT_MEDIA_TYPES[fmt],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
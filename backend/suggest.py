@@ -0,0 +1,71 @@
+# suggest.py - autocomplete giá trị filter (địa điểm, hình thức LCNT, chủ đầu tư, ...) từ index trong RAM
+# Giá trị distinct được load 1 lần / data version → mỗi lần gõ chỉ bisect trên list đã sort, không query Postgres.
+import bisect
+import heapq
+
+from text_norm import fold_text
+
+_MAX_KEY = "\uffff"
+# Prefix khớp nhiều entry hơn ngưỡng này ("b", "benh vien") → nhớ kết quả (index build lại mỗi data version)
+BROAD_PREFIX_ENTRIES = 2000
+
+
+class PrefixIndex:
+    """
+    Index prefix trên key đã fold (bỏ dấu, lowercase) của các giá trị distinct 1 cột.
+    Mỗi giá trị có 1 entry cho mỗi vị trí đầu từ → 'da khoa' khớp 'Bệnh viện Đa khoa tỉnh ...'.
+    Kết quả: khớp từ đầu chuỗi trước, sau đó nhiều row nhất trước.
+    """
+
+    def __init__(self, counts: dict):
+        # rank = thứ tự theo số row giảm dần (cùng số row → theo key)
+        self.values = sorted(counts, key=lambda v: (-counts[v], fold_text(v)))
+        self.counts = [counts[v] for v in self.values]
+        self.folded = [fold_text(v) or "" for v in self.values]
+
+        entries = []
+        for rank, key in enumerate(self.folded):
+            pos = 0
+            for word in key.split(" "):
+                if word:
+                    entries.append((key[pos:], rank))
+                pos += len(word) + 1
+        entries.sort()
+        self._keys = [k for k, _ in entries]
+        self._ranks = [r for _, r in entries]
+        self._broad = {}
+
+    def __len__(self):
+        return len(self.values)
+
+    def search(self, prefix: str, limit: int = 20) -> list:
+        """[{value, count}] khớp prefix (đã fold), rỗng → giá trị phổ biến nhất"""
+        q = fold_text(prefix) or ""
+        if not q:
+            ranks = range(min(limit, len(self.values)))
+        else:
+            lo = bisect.bisect_left(self._keys, q)
+            hi = bisect.bisect_left(self._keys, q + _MAX_KEY, lo)
+            if hi - lo > BROAD_PREFIX_ENTRIES:
+                ranks = self._broad.get((q, limit))
+                if ranks is None:
+                    ranks = self._broad[(q, limit)] = self._top(q, lo, hi, limit)
+            else:
+                ranks = self._top(q, lo, hi, limit)
+        return [{"value": self.values[r], "count": self.counts[r]} for r in ranks]
+
+    def _top(self, q: str, lo: int, hi: int, limit: int) -> list:
+        """Top limit trên toàn bộ khoảng [lo, hi) của bisect (không dừng ở N key đầu theo alphabet)"""
+        matched = set(self._ranks[lo:hi])
+        return heapq.nsmallest(limit, matched, key=lambda r: (not self.folded[r].startswith(q), r))
+
+
+def build_indexes(rows) -> dict:
+    """rows (field, value, count), cùng value ở nhiều view được cộng dồn → {field: PrefixIndex}"""
+    counts = {}
+    for field, value, n in rows:
+        if value is None or not str(value).strip():
+            continue
+        field_counts = counts.setdefault(field, {})
+        field_counts[value] = field_counts.get(value, 0) + n
+    return {field: PrefixIndex(c) for field, c in counts.items()}
@@ -0,0 +1,23 @@
+from suggest import PrefixIndex, build_indexes
+
+
+def test_broad_prefix_ranks_whole_range():
+    # 12k giá trị "benh vien ..." đứng trước theo alphabet, giá trị nhiều row nhất nằm cuối
+    counts = {f"Bệnh viện A{i:05d}": 1 for i in range(12000)}
+    counts["Bệnh viện Z tỉnh"] = 1000
+    index = PrefixIndex(counts)
+
+    for prefix in ("b", "benh vien", "Bệnh"):
+        assert index.search(prefix, 3)[0] == {"value": "Bệnh viện Z tỉnh", "count": 1000}
+    # lần 2: kết quả nhớ sẵn cho prefix rộng
+    assert index.search("b", 3)[0]["value"] == "Bệnh viện Z tỉnh"
+
+
+def test_word_start_match_after_prefix_match():
+    index = PrefixIndex({"Đa khoa Hà Nội": 1, "Bệnh viện Đa khoa": 50})
+    assert [s["value"] for s in index.search("da khoa")] == ["Đa khoa Hà Nội", "Bệnh viện Đa khoa"]
+
+
+def test_build_indexes_merges_views():
+    indexes = build_indexes([("place", "Hà Nội", 2), ("place", "Hà Nội", 3), ("place", " ", 9)])
+    assert indexes["place"].search("ha") == [{"value": "Hà Nội", "count": 5}]
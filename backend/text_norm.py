@@ -0,0 +1,22 @@
+# text_norm.py - chuẩn hóa text tiếng Việt cho search (dùng chung loader + server)
+import re
+import unicodedata
+from functools import lru_cache
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=100_000)
+def _fold(s: str) -> str:
+    s = s.replace("đ", "d").replace("Đ", "D")
+    s = unicodedata.normalize("NFD", s)
+    s = "".join(ch for ch in s if unicodedata.category(ch) != "Mn")
+    return _WHITESPACE.sub(" ", s).strip().lower()
+
+
+def fold_text(value):
+    """Bỏ dấu + lowercase + gộp khoảng trắng: 'Viên  NÉN' → 'vien nen'"""
+    if value is None:
+        return None
+    return _fold(str(value))
+
@@ -1,18 +1,45 @@
-# update_db.py - update hàng ngày (TRUNCATE + INSERT)
+# update_db.py - update hàng ngày (load staging + swap atomic, hoặc incremental theo Mã TBMT)
 import os
 import json
 import time
+from concurrent.futures import ProcessPoolExecutor
 import psycopg2
-import pandas as pd
-import numpy as np
 from dotenv import load_dotenv
 from datetime import datetime
 from pathlib import Path
 from urllib.parse import urlparse
 from psycopg2.extras import execute_values
+from schema import (
+    DATA_TABLES, FULL_VIEWS, FACET_ROLLUP, staging_name, create_hash_table, refresh_views, build_facet_rollup,
+    create_data_version_table, bump_data_version, tune_load_session,
+    create_staging_tables, create_staging_views, create_staging_indexes, swap_staging_tables, drop_staging_tables,
+)
+from ingest import table_sources, table_source, DATA_TABLE_FILES
+from loader import TbmtHasher, load_chunks, replace_hashes, sync_table_delta
+from load_profile import LoadProfiler, peak_rss_mb
 
 load_dotenv()
 
+# "copy": COPY FROM STDIN (mặc định, 1 round-trip/bảng) | "insert": INSERT theo chunk kiểu cũ
+LOAD_MODE = os.getenv("LOAD_MODE", "copy").lower()
+
+# Chờ lock tối đa khi swap (reader đang chạy query dài) → fail thay vì chặn hàng đợi reader
+SWAP_LOCK_TIMEOUT = os.getenv("SWAP_LOCK_TIMEOUT", "30s")
+
+# "swap": load lại toàn bộ vào staging rồi swap (mặc định)
+# "incremental": chỉ DELETE/INSERT các gói thầu (Mã TBMT) có nội dung thay đổi so với tbmt_hash
+UPDATE_MODE = os.getenv("UPDATE_MODE", "swap").lower()
+
+# Số worker process load staging song song (swap mode): mỗi process đọc + convert + COPY 1 bảng
+# trên connection riêng → tổng thời gian ~ bảng lớn nhất. 1 = tuần tự trên connection chính.
+# Swap (và data_version) vẫn trong 1 transaction trên connection chính → vẫn atomic.
+# Incremental luôn tuần tự: delta cả 3 bảng phải nằm trong 1 transaction.
+LOAD_WORKERS = int(os.getenv("LOAD_WORKERS", "1"))
+
+# Số connection build index staging cùng lúc (swap mode, sau khi load + build view xong).
+# Mỗi connection dùng tới LOAD_MAINTENANCE_WORK_MEM → tăng dần theo RAM của Postgres. 1 = tuần tự.
+INDEX_WORKERS = int(os.getenv("INDEX_WORKERS", "1"))
+
 def get_db_connection():
     load_dotenv()
     DATABASE_URL = os.getenv("DATABASE_URL")
@@ -47,21 +74,6 @@ def log_step(step, details=""):
     ts = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     print(f"[{ts}] {step} {details}")
 
-def clean_df(df: pd.DataFrame) -> pd.DataFrame:
-    df = df.copy()
-    df = df.replace([np.nan, np.inf, -np.inf], None)
-    for col in df.columns:
-        if pd.api.types.is_datetime64_any_dtype(df[col]):
-            df[col] = pd.to_datetime(df[col], errors="coerce")
-    return df
-
-def df_to_records(df: pd.DataFrame):
-    records = []
-    cols = df.columns.tolist()
-    for _, row in df.iterrows():
-        records.append(tuple(row[c] for c in cols))
-    return records, cols
-
 def insert_chunk(cur, table_name, columns, records, chunk_size=5000):
     if not records:
         return
@@ -77,15 +89,161 @@ def insert_chunk(cur, table_name, columns, records, chunk_size=5000):
 
         log_step(f"📤 Insert {table_name}", f"chunk {i//chunk_size + 1}: {len(chunk)} rows")
 
+def load_staging_table(table_name):
+    """
+    Chạy trong worker process (LOAD_WORKERS > 1): đọc file + convert + load 1 bảng staging
+    trên connection riêng rồi commit (staging chưa được đọc bởi ai, swap vẫn do connection chính).
+    Returns: (bảng, số row, số giây, stats load_chunks, hash theo Mã TBMT, peak RSS worker)
+    """
+    conn = get_db_connection()
+    try:
+        hasher = TbmtHasher()
+        stats = {}
+        with conn.cursor() as cur:
+            rows, elapsed = load_chunks(cur, staging_name(table_name), table_source(table_name)(), LOAD_MODE,
+                                        insert_chunk, on_chunk=hasher.update, stats=stats)
+        conn.commit()
+        return table_name, rows, elapsed, stats, hasher.hashes(), peak_rss_mb()
+    finally:
+        conn.close()
+
+def load_staging_parallel(profiler):
+    """3 bảng staging song song trên LOAD_WORKERS process. Returns: {bảng: hash theo Mã TBMT}"""
+    table_names = [table for table, _ in DATA_TABLE_FILES]
+    workers = min(LOAD_WORKERS, len(table_names))
+    log_step("⚡ Parallel staging load", f"{workers} workers, 1 connection/table")
+    hashes = {}
+    with profiler.stage("parallel_load"):
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            # Bảng lớn nhất (df1) submit trước → không phải chờ nó sau cùng
+            for table_name, rows, elapsed, stats, table_hashes, worker_rss in pool.map(load_staging_table, table_names):
+                profiler.add_load(table_name, rows, elapsed, stats)
+                hashes[table_name] = table_hashes
+                log_step(f"⏱️ Loaded {staging_name(table_name)}",
+                         f"{rows:,} rows in {elapsed:.1f}s ({rows / max(elapsed, 1e-6):,.0f} rows/s, "
+                         f"{LOAD_MODE}, worker peak {worker_rss} MB)")
+    return hashes
+
+def write_run_history(cur, run_history_data, profiler):
+    # run_history nhỏ: DELETE (MVCC, không block /api/metadata) thay vì TRUNCATE
+    cur.execute("DELETE FROM run_history;")
+    if run_history_data:
+        log_step("📤 Inserting run_history...", f"{len(run_history_data)} rows")
+        sql = """
+            INSERT INTO run_history (start_time, end_time, duration_seconds, boxes_selected)
+            VALUES (%s, %s, %s, %s)
+        """
+        rows = []
+        for item in run_history_data:
+            rows.append((
+                item.get("start_time"),
+                item.get("end_time"),
+                item.get("duration_seconds"),
+                item.get("boxes_selected"),
+            ))
+        with profiler.stage("run_history", rows=len(rows)):
+            cur.executemany(sql, rows)
+
+def swap_update(conn, cur, tables, profiler, run_history_data):
+    """
+    Full reload: load staging → index → hash + run_history → swap (transaction swap chưa commit,
+    main bump_data_version + commit ngay sau). tables=None → load song song bằng worker process (LOAD_WORKERS > 1).
+    """
+    # Bảng staging: load vào bảng riêng, /api/query vẫn đọc bảng live không bị lock
+    log_step("🧱 Creating staging tables...", "")
+    with profiler.stage("staging_tables"):
+        create_staging_tables(cur)
+        conn.commit()
+
+    # Load df1, df2, add_info vào staging (COPY hoặc INSERT theo LOAD_MODE), hash gói thầu tính kèm từng chunk
+    if tables is None:
+        hashes = load_staging_parallel(profiler)
+    else:
+        hashes = {}
+        for table_name, source in tables:
+            hasher = TbmtHasher()
+            stats = {}
+            rows, elapsed = load_chunks(cur, staging_name(table_name), source(), LOAD_MODE, insert_chunk,
+                                        on_chunk=hasher.update, stats=stats)
+            profiler.add_load(table_name, rows, elapsed, stats)
+            hashes[table_name] = hasher.hashes()
+            log_step(f"⏱️ Loaded {staging_name(table_name)}",
+                     f"{rows:,} rows in {elapsed:.1f}s ({rows / max(elapsed, 1e-6):,.0f} rows/s, {LOAD_MODE})")
+
+    # Materialized view + facet rollup staging, rồi mới index (build 1 lần sau khi load, không maintain từng row).
+    # Commit trước để connection build index song song thấy bảng/view staging.
+    log_step("⚙️ Building staging views...", "")
+    with profiler.stage("views"):
+        create_staging_views(cur)
+        conn.commit()
+    log_step("⚙️ Indexing staging tables & views...", f"{INDEX_WORKERS} connection(s)")
+    with profiler.stage("indexes"):
+        create_staging_indexes(cur, get_db_connection, INDEX_WORKERS)
+    with profiler.stage("analyze"):
+        for tbl in DATA_TABLES + list(FULL_VIEWS) + [FACET_ROLLUP]:
+            cur.execute(f"ANALYZE {staging_name(tbl)};")
+        conn.commit()
+    log_step("✅ Staging loaded, indexed & analyzed", "")
+
+    # Hash mới cho lần incremental sau + run_history: cùng transaction với swap nhưng ghi TRƯỚC swap
+    # → lock ACCESS EXCLUSIVE của DROP/RENAME không bị giữ trong lúc DELETE + COPY toàn bộ tbmt_hash
+    with profiler.stage("hashes"):
+        for table_name, table_hashes in hashes.items():
+            replace_hashes(cur, table_name, table_hashes)
+    write_run_history(cur, run_history_data, profiler)
+
+    # Swap staging → live: chỉ còn DDL rename (+ bump_data_version của main) trước COMMIT
+    log_step("🔁 Swapping staging tables...", "")
+    with profiler.stage("swap"):
+        cur.execute(f"SET LOCAL lock_timeout = '{SWAP_LOCK_TIMEOUT}';")
+        swap_staging_tables(cur)
+
+
+def incremental_update(cur, tables, profiler):
+    """
+    Delta theo Mã TBMT trên bảng live, cả 3 bảng trong 1 transaction (main commit cùng run_history).
+    Returns: các bảng/view có thay đổi (cần ANALYZE)
+    """
+    changed_tables = []
+    for table_name, source in tables:
+        t0 = time.perf_counter()
+        stats = sync_table_delta(cur, table_name, source, LOAD_MODE, insert_chunk)
+        profiler.add("delta", time.perf_counter() - t0, stats["inserted_rows"], table_name)
+        log_step(f"🔀 Delta {table_name}",
+                 f"+{stats['added']} new, ~{stats['changed']} changed, -{stats['removed']} removed, "
+                 f"{stats['unchanged']} unchanged TBMT | rows -{stats['deleted_rows']:,} "
+                 f"+{stats['inserted_rows']:,} in {time.perf_counter() - t0:.1f}s")
+        if stats["deleted_rows"] or stats["inserted_rows"]:
+            changed_tables.append(table_name)
+
+    # Materialized view join sẵn → build lại (CONCURRENTLY, cùng transaction với delta)
+    if changed_tables:
+        t0 = time.perf_counter()
+        with profiler.stage("refresh_views"):
+            refresh_views(cur)
+        with profiler.stage("facet_rollup"):
+            build_facet_rollup(cur)
+        log_step("🔄 Refreshed df1_full/df2_full + facet rollup", f"{time.perf_counter() - t0:.1f}s")
+        changed_tables += list(FULL_VIEWS) + [FACET_ROLLUP]
+    return changed_tables
+
+
 def main():
     start = time.time()
     log_step("🚀 DAILY UPDATE START", "="*40)
+    # Thời gian + RSS từng bước → report JSON cuối job + bảng load_profile
+    parallel = UPDATE_MODE != "incremental" and LOAD_WORKERS > 1
+    profiler = LoadProfiler("update_db.py", f"{UPDATE_MODE}/{LOAD_MODE}" + (f"/parallel{LOAD_WORKERS}" if parallel else "")
+                            + (f"/index{INDEX_WORKERS}" if UPDATE_MODE != "incremental" and INDEX_WORKERS > 1 else ""))
+    if LOAD_WORKERS > 1 and not parallel:
+        log_step("⚠️ LOAD_WORKERS ignored", "incremental chạy tuần tự (delta 3 bảng trong 1 transaction)")
 
     # 1. Load latest files
     log_step("📂 Loading latest Excel/JSON...")
-    df1 = clean_df(pd.read_excel("processed/columns_19_20.xlsx"))
-    df2 = clean_df(pd.read_excel("processed/columns_13_14.xlsx"))
-    add_info = clean_df(pd.read_excel("processed/additional_info_log.xlsx"))
+    # frame: xlsx → cache Parquet (parse song song khi file đổi) | stream: đọc theo chunk lúc load
+    # Mỗi chunk đã clean_df + cột search bỏ dấu (norm_*)
+    # Song song: mỗi worker tự đọc file của bảng mình (không đọc 3 file ở process chính)
+    tables = None if parallel else table_sources(log=log_step, profiler=profiler)
 
     run_history_file = Path("processed/run_history.json")
     if run_history_file.exists():
@@ -94,78 +252,64 @@ def main():
     else:
         run_history_data = []
 
-    log_step("✅ Loaded",
-             f"df1={len(df1)}, df2={len(df2)}, add_info={len(add_info)}, runs={len(run_history_data)}")
+    log_step("✅ Loaded", f"runs={len(run_history_data)}")
 
     conn = None
     try:
         log_step("🔗 Connecting PostgreSQL...")
         conn = get_db_connection()
         cur = conn.cursor()
-        
-        # 2. TRUNCATE 4 tables
-        log_step("🗑️ Truncating tables...", "")
-        cur.execute("TRUNCATE TABLE df1_standard RESTART IDENTITY;")
-        cur.execute("TRUNCATE TABLE df2_extended RESTART IDENTITY;")
-        cur.execute("TRUNCATE TABLE additional_info_log RESTART IDENTITY;")
-        cur.execute("TRUNCATE TABLE run_history RESTART IDENTITY;")
-        log_step("✅ Tables truncated", "")
-
-        # 3. Insert df1, df2, add_info
-        if len(df1) > 0:
-            rec1, cols1 = df_to_records(df1)
-            insert_chunk(cur, "df1_standard", cols1, rec1)
-
-        if len(df2) > 0:
-            rec2, cols2 = df_to_records(df2)
-            insert_chunk(cur, "df2_extended", cols2, rec2)
-
-        if len(add_info) > 0:
-            rec3, cols3 = df_to_records(add_info)
-            insert_chunk(cur, "additional_info_log", cols3, rec3)
-
-        # 4. Insert run_history
-        if run_history_data:
-            log_step("📤 Inserting run_history...", f"{len(run_history_data)} rows")
-            sql = """
-                INSERT INTO run_history (start_time, end_time, duration_seconds, boxes_selected)
-                VALUES (%s, %s, %s, %s)
-            """
-            rows = []
-            for item in run_history_data:
-                rows.append((
-                    item.get("start_time"),
-                    item.get("end_time"),
-                    item.get("duration_seconds"),
-                    item.get("boxes_selected"),
-                ))
-            cur.executemany(sql, rows)
+        tune_load_session(cur)
 
+        # 2. Update dữ liệu theo UPDATE_MODE
+        create_hash_table(cur)
+        create_data_version_table(cur)
         conn.commit()
-        log_step("✅ Data committed", "")
 
-        # 5. Optional: ANALYZE
-        cur.execute("ANALYZE df1_standard;")
-        cur.execute("ANALYZE df2_extended;")
-        cur.execute("ANALYZE additional_info_log;")
-        cur.execute("ANALYZE run_history;")
-        conn.commit()
-        log_step("✅ & Analyze completed", "")
+        if UPDATE_MODE == "incremental":
+            write_run_history(cur, run_history_data, profiler)
+            changed_tables = incremental_update(cur, tables, profiler)
+        else:
+            swap_update(conn, cur, tables, profiler, run_history_data)
+            changed_tables = []
+
+        # Cùng transaction với data → server.py xóa cache /api/query khi thấy version mới
+        # (incremental không có delta → giữ version, cache vẫn đúng)
+        with profiler.stage("commit"):
+            if UPDATE_MODE != "incremental" or changed_tables:
+                bump_data_version(cur)
+            conn.commit()
+        log_step("✅ Data committed", UPDATE_MODE)
+
+        with profiler.stage("analyze_live"):
+            for tbl in changed_tables + ["run_history"]:
+                cur.execute(f"ANALYZE {tbl};")
+            conn.commit()
 
-        # 6. Verify
-        for tbl in ["df1_standard", "df2_extended", "additional_info_log", "run_history"]:
-            cur.execute(f"SELECT COUNT(*) FROM {tbl}")
-            cnt = cur.fetchone()[0]
-            log_step("📊 Table rows", f"{tbl}: {cnt} rows")
+        # 3. Verify
+        with profiler.stage("verify"):
+            for tbl in ["df1_standard", "df2_extended", "additional_info_log", "run_history"]:
+                cur.execute(f"SELECT COUNT(*) FROM {tbl}")
+                cnt = cur.fetchone()[0]
+                log_step("📊 Table rows", f"{tbl}: {cnt} rows")
 
+        profiler.success = True
         log_step("🎉 DAILY UPDATE COMPLETED", f"{time.time()-start:.1f}s")
 
     except Exception as e:
+        profiler.success = False
         if conn:
             conn.rollback()
+            # Bảng live không đổi; dọn staging (lần chạy sau cũng tự drop lại)
+            try:
+                drop_staging_tables(cur)
+                conn.commit()
+            except Exception:
+                conn.rollback()
         log_step("❌ DAILY UPDATE FAILED", str(e))
         import traceback; traceback.print_exc()
     finally:
+        profiler.save(conn, log=log_step)
         if conn:
             conn.close()
             log_step("🔌 Connection closed ", "="*40)
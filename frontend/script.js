@@ -622,7 +622,35 @@ const FILTER_CONFIG = {
 };
 
 const MAX_RESULTS_PER_TABLE = 200;
+const COUNT_MODE = 'capped';    // server chỉ đếm tới ngưỡng (vd "10.000+") thay vì COUNT(*) toàn bộ
 let currentFilterState = {};
+let nextCursors = { df1: null, df2: null };   // cursor trang tiếp theo từ server (keyset)
+
+// Payload gọn: tên cột gửi 1 lần, cột text lặp nhiều (Xuất xứ, Đơn vị tính...) gửi dạng index vào dicts
+const RESPONSE_SHAPE = 'dict';
+
+// {columns, rows, dicts} → [{cột: giá trị}] (giữ nguyên nếu server trả data dạng cũ)
+function decodeTableRows(tableResult) {
+    if (!tableResult || Array.isArray(tableResult.data)) return tableResult?.data ?? [];
+    const columns = tableResult.columns || [];
+    const dicts = tableResult.dicts || {};
+    const lookups = columns.map((_, i) => dicts[i] || null);
+    return (tableResult.rows || []).map(row => {
+        const obj = {};
+        for (let i = 0; i < columns.length; i++) {
+            const v = row[i];
+            obj[columns[i]] = (lookups[i] && v !== null) ? lookups[i][v] : v;
+        }
+        return obj;
+    });
+}
+
+function decodeQueryResult(result) {
+    ['df1', 'df2'].forEach(table => {
+        if (result?.[table]) result[table].data = decodeTableRows(result[table]);
+    });
+    return result;
+}
 
 // ======== 1. APPLY
 async function applyFilters(payload) {
@@ -636,23 +664,27 @@ async function applyFilters(payload) {
             body: JSON.stringify({
                 filters: payload,
                 sort: sortRules.length > 0 ? sortRules : null,
-                limit: MAX_RESULTS_PER_TABLE
+                limit: MAX_RESULTS_PER_TABLE,
+                countMode: COUNT_MODE,
+                shape: RESPONSE_SHAPE
             })
         });
         
         if (!response.ok) throw new Error(`HTTP ${response.status}`);
-        const result = await response.json();
+        const result = decodeQueryResult(await response.json());
         
         if (result.success) {
             currentFilteredDf1 = result.df1.data;
             currentFilteredDf2 = result.df2.data;
+            setNextCursors(result);
             
             // ✅ LIMIT WARNING từ server count
-            const totalCount = result.df1.count + result.df2.count;
+            const totalCount = (result.df1.count ?? 0) + (result.df2.count ?? 0);
+            const countCapped = result.df1.countCapped || result.df2.countCapped;
             const displayedCount = currentFilteredDf1.length + currentFilteredDf2.length;
             
             if (totalCount > displayedCount) {
-                showLimitWarning(totalCount, displayedCount);
+                showLimitWarning(totalCount, displayedCount, countCapped);
             } else {
                 hideLimitWarning();
             }
@@ -663,17 +695,84 @@ async function applyFilters(payload) {
     } catch (err) {
         console.error('❌ Filter failed:', err);
         currentFilteredDf1 = []; currentFilteredDf2 = [];
+        setNextCursors(null);
         updateResults([], []);
         hideLimitWarning();
     }
 }
 
 
+// ======== 1b. PAGINATION (keyset cursor)
+function setNextCursors(result) {
+    nextCursors = {
+        df1: result?.df1?.nextCursor ?? null,
+        df2: result?.df2?.nextCursor ?? null
+    };
+    updateLoadMoreButtons();
+}
+
+function updateLoadMoreButtons() {
+    ['df1', 'df2'].forEach(table => {
+        const btn = document.getElementById(`${table}-load-more`);
+        if (btn) btn.style.display = nextCursors[table] ? 'inline-block' : 'none';
+    });
+}
+
+async function loadMore(table) {
+    const cursor = nextCursors[table];
+    if (!cursor) return;
+
+    const btn = document.getElementById(`${table}-load-more`);
+    if (btn) btn.disabled = true;
+
+    try {
+        const response = await fetch(`${API_BASE_URL}/api/query`, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({
+                filters: currentFilterState,
+                sort: sortRules.length > 0 ? sortRules : null,
+                limit: MAX_RESULTS_PER_TABLE,
+                countMode: 'none',
+                shape: RESPONSE_SHAPE,
+                cursors: { [table]: cursor },
+                tables: [table]
+            })
+        });
+
+        if (!response.ok) throw new Error(`HTTP ${response.status}`);
+        const result = decodeQueryResult(await response.json());
+
+        if (result.success) {
+            if (table === 'df1') {
+                currentFilteredDf1 = currentFilteredDf1.concat(result.df1.data);
+            } else {
+                currentFilteredDf2 = currentFilteredDf2.concat(result.df2.data);
+            }
+            nextCursors[table] = result[table].nextCursor ?? null;
+            updateLoadMoreButtons();
+            updateResults(currentFilteredDf1, currentFilteredDf2);
+            console.log(`✅ Loaded ${result[table].displayed} more rows for ${table.toUpperCase()}`);
+        }
+    } catch (err) {
+        console.error('❌ Load more failed:', err);
+    } finally {
+        if (btn) btn.disabled = false;
+    }
+}
+
+function initLoadMore() {
+    ['df1', 'df2'].forEach(table => {
+        document.getElementById(`${table}-load-more`)?.addEventListener('click', () => loadMore(table));
+    });
+}
+
 // Helper: Show limit warning
-function showLimitWarning(totalCount, displayedCount) {
+function showLimitWarning(totalCount, displayedCount, countCapped = false) {
+    const totalText = totalCount.toLocaleString('vi-VN') + (countCapped ? '+' : '');
     alert(
         `⚠️ GIỚI HẠN KẾT QUẢ TÌM KIẾM\n\n` +
-        `Hệ thống ghi nhận ${totalCount.toLocaleString('vi-VN')} bản ghi phù hợp.\n` +
+        `Hệ thống ghi nhận ${totalText} bản ghi phù hợp.\n` +
         `Hiện tại chỉ ${displayedCount.toLocaleString('vi-VN')} kết quả đầu tiên được hiển thị.\n\n` +
         `Để truy xuất đầy đủ, đề nghị:\n` +
         `- Bổ sung từ khóa tìm kiếm\n` +
@@ -1089,16 +1188,19 @@ async function applySortRules() {
             body: JSON.stringify({
                 filters: currentFilterState,
                 sort: sortRules,              // ✅ Gửi sortRules lên server
-                limit: MAX_RESULTS_PER_TABLE
+                limit: MAX_RESULTS_PER_TABLE,
+                countMode: 'none',            // sort lại không cần đếm
+                shape: RESPONSE_SHAPE
             })
         });
         
         if (!response.ok) throw new Error(`HTTP ${response.status}`);
-        const result = await response.json();
+        const result = decodeQueryResult(await response.json());
         
         if (result.success) {
             currentFilteredDf1 = result.df1.data;
             currentFilteredDf2 = result.df2.data;
+            setNextCursors(result);
             
             updateResults(currentFilteredDf1, currentFilteredDf2);
             
@@ -1154,16 +1256,19 @@ async function resetSortToDefault() {
       body: JSON.stringify({
         filters: currentFilterState,
         sort: null,
-        limit: MAX_RESULTS_PER_TABLE
+        limit: MAX_RESULTS_PER_TABLE,
+        countMode: 'none',
+        shape: RESPONSE_SHAPE
       })
     });
 
     if (!response.ok) throw new Error(`HTTP ${response.status}`);
-    const result = await response.json();
+    const result = decodeQueryResult(await response.json());
 
     if (result.success) {
       currentFilteredDf1 = result.df1.data;
       currentFilteredDf2 = result.df2.data;
+      setNextCursors(result);
       updateResults(currentFilteredDf1, currentFilteredDf2);
       console.log('✅ Sort reset to server default ORDER BY');
     }
@@ -1952,12 +2057,51 @@ function prepareExportData(data, headerOrder, currentOrder) {
         }));
 }
 
+// Export toàn bộ kết quả (không giới hạn 200 dòng) qua /api/export, server stream CSV
+async function exportFromServer(table) {
+    const response = await fetch(`${API_BASE_URL}/api/export?table=${table}&format=csv`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({
+            filters: currentFilterState,
+            sort: sortRules.length > 0 ? sortRules : null
+        })
+    });
+    if (!response.ok) throw new Error(`HTTP ${response.status}`);
+
+    const blob = await response.blob();
+    const url = URL.createObjectURL(blob);
+    const a = document.createElement('a');
+    a.href = url;
+    a.download = generateExportFilename().replace('.xlsx', `_${table}.csv`);
+    document.body.appendChild(a);
+    a.click();
+    a.remove();
+    URL.revokeObjectURL(url);
+}
+
 function initExcelExport() {
-    document.getElementById('export-excel-btn')?.addEventListener('click', () => {
+    document.getElementById('export-excel-btn')?.addEventListener('click', async () => {
         if (currentFilteredDf1.length === 0 && currentFilteredDf2.length === 0) {
             alert('Không có dữ liệu để xuất!');
             return;
         }
+
+        // Còn trang chưa tải → cho phép xuất toàn bộ kết quả từ server (CSV)
+        const tablesWithMore = ['df1', 'df2'].filter(t => nextCursors[t]);
+        if (tablesWithMore.length > 0 &&
+            confirm('Kết quả còn nhiều hơn số dòng đang hiển thị.\nXuất TOÀN BỘ kết quả ra CSV từ server?')) {
+            try {
+                for (const table of tablesWithMore) {
+                    await exportFromServer(table);
+                }
+                console.log('✅ Server export:', tablesWithMore);
+            } catch (err) {
+                console.error('❌ Server export failed:', err);
+                alert('Xuất dữ liệu từ server thất bại, vui lòng thử lại.');
+            }
+            return;
+        }
         
         const wb = XLSX.utils.book_new();
         
@@ -2005,6 +2149,7 @@ function initSearchFormEvents() {
         currentFilterState = {};            // xóa state filter logic
         currentFilteredDf1 = [];
         currentFilteredDf2 = [];
+        setNextCursors(null);
         updateResults([], []);
     });
 }
@@ -2052,6 +2197,7 @@ document.addEventListener('DOMContentLoaded', function() {
     initExcelExport();
     initSearchFormEvents();
     initSortPanel();
+    initLoadMore();
     disableDefaultTooltips();
     loadDataFromAPI();
 });
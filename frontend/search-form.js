@@ -740,6 +740,7 @@ class CustomSearchForm extends HTMLElement {
         `;
         // ✅ Disable nút áp dụng lúc ban đầu + theo dõi input thay đổi
         this.attachInputListeners();
+        this.setupSuggestions();
         this.updateApplyButtonState();
         this.setupSelectPlaceholderColors();
         this.setupDateEmptyState();
@@ -1214,6 +1215,54 @@ class CustomSearchForm extends HTMLElement {
 
     }
 
+    // ✅ Autocomplete: gợi ý giá trị từ /api/suggest (index trong RAM của server, gõ không dấu vẫn khớp)
+    setupSuggestions() {
+        const root = this.shadowRoot;
+        if (!root) return;
+
+        const fields = {
+            'filter-investor': 'investor',
+            'filter-manufacturer': 'manufacturer',
+            'filter-country': 'country'
+        };
+
+        Object.entries(fields).forEach(([inputId, field]) => {
+            const input = root.getElementById(inputId);
+            if (!input) return;
+
+            const list = document.createElement('datalist');
+            list.id = `${inputId}-suggestions`;
+            root.appendChild(list);
+            input.setAttribute('list', list.id);
+            input.setAttribute('autocomplete', 'off');
+
+            let timer = null;
+            let lastQuery = null;
+            input.addEventListener('input', () => {
+                clearTimeout(timer);
+                timer = setTimeout(async () => {
+                    const q = input.value.trim();
+                    if (q === lastQuery) return;
+                    lastQuery = q;
+                    try {
+                        const params = new URLSearchParams({ field, q, limit: '15' });
+                        const res = await fetch(`${API_BASE_URL}/api/suggest?${params}`);
+                        const data = await res.json();
+                        if (!data.success || q !== input.value.trim()) return;
+                        list.replaceChildren(...data.suggestions.map(s => {
+                            const option = document.createElement('option');
+                            option.value = s.value;
+                            option.label = `${s.count.toLocaleString('vi-VN')} dòng`;
+                            return option;
+                        }));
+                    } catch (err) {
+                        console.warn('⚠️ Suggest failed:', err);
+                    }
+                }, 150);
+            });
+        });
+    }
+
     attachInputListeners() {
         const root = this.shadowRoot;
         if (!root) return;